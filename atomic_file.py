@@ -0,0 +1,17 @@
+import os, threading
+
+# --- 原子写文件 ---
+# 日志、缓存、指标文件都先写到同目录的临时文件, 再 os.replace 覆盖:
+# 中途崩溃或断电只会留下旧文件, 读取方 (续跑、采集端) 不会看到写了一半的内容。
+
+def write_atomic(path, text):
+    """把 text 整体写入 path; 失败时抛出 OSError, 不留临时文件"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"   # 多进程/多线程同时写互不覆盖
+    try:
+        with open(tmp, "w", encoding="utf-8") as fp: fp.write(text)
+        os.replace(tmp, path)
+    except OSError:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
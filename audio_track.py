@@ -0,0 +1,48 @@
+import os, hashlib
+from ffmpeg_runner import supervisor
+
+# --- 整片音频中间文件 ---
+# 每个源文件的音频只处理一次: 源已是 AAC 时直接复制, 否则转成 aac 192k, 写到 .m4a 中间文件;
+# 各分段压制时只编码视频, 音频从中间文件按时间截取后原样复制。
+# 分段不再各自重启 AAC 编码器 (每次起编都有 priming 静音), 相邻分集的音频在切点处按 AAC 帧
+# (约 21ms) 对齐衔接, 也不会随集数累积漂移。
+
+AUDIO_DIR = ".audio"   # 输出目录下, 以 "." 开头, 不会被当成输入
+AUDIO_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+SEGMENT_AUDIO_MAP = ["-map", "0:v:0", "-map", "1:a:0", "-c:a", "copy"]
+
+def intermediate_path(cache_dir, src):
+    """同一源文件 (路径+大小+修改时间) 对应固定的中间文件名, 续跑时直接复用"""
+    st = os.stat(src)
+    key = f"{os.path.normcase(os.path.abspath(src))}|{st.st_size}|{st.st_mtime_ns}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".m4a")
+
+def build_audio_cmd(ffmpeg, in_p, out_p, copy):
+    return [ffmpeg, "-y", "-hide_banner", "-nostats", "-i", in_p, "-map", "0:a:0", "-vn", "-sn", "-dn"] \
+           + (["-c:a", "copy"] if copy else AUDIO_ARGS) + ["-f", "mp4", out_p]
+
+def extract_audio(ffmpeg, in_p, cache_dir, copy):
+    """返回中间文件路径; 失败返回 None, 调用方回退为每段各自编码音频"""
+    try:
+        out_p = intermediate_path(cache_dir, in_p)
+        if os.path.exists(out_p): return out_p
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return None
+    tmp = f"{out_p}.{os.getpid()}.part"
+    try:
+        res = supervisor().run(build_audio_cmd(ffmpeg, in_p, tmp, copy), tail=3)
+        if res.ok and os.path.getsize(tmp) > 0:
+            os.replace(tmp, out_p); return out_p
+        os.remove(tmp)
+    except OSError:
+        pass
+    return None
+
+def audio_input_args(audio_p, start, dur):
+    """分段命令的第二路输入: 中间文件中该段时间范围内的音频"""
+    return ["-ss", str(round(start, 3)), "-t", str(round(dur, 3)), "-i", audio_p]
+
+def remove_audio(audio_p):
+    try: os.remove(audio_p)
+    except OSError: pass
@@ -0,0 +1,104 @@
+import os, time, threading
+
+# --- 自适应并发 ---
+# 压制线程按上限 max_workers 全部启动, 但每取一个任务前要先拿到一个"名额";
+# 调度线程定期根据总压制速度 (进度总线里每秒完成的内容秒数)、CPU 与内存占用
+# 调整名额数: 有空闲算力就加一个, 加了没变快就退回, 内存吃紧就减。
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+def cpu_load():
+    """CPU 占用百分比; 无法获取时返回 None"""
+    if HAS_PSUTIL: return psutil.cpu_percent(None)
+    if hasattr(os, "getloadavg"): return min(100.0, os.getloadavg()[0] / (os.cpu_count() or 1) * 100)
+    return None
+
+def memory_load():
+    """内存占用百分比; 无法获取时返回 None"""
+    if HAS_PSUTIL: return psutil.virtual_memory().percent
+    try:
+        with open("/proc/meminfo") as fp:
+            kv = {l.split(":")[0]: int(l.split()[1]) for l in fp if l.split()[1:2] and l.split()[1].isdigit()}
+        return 100.0 * (1 - kv["MemAvailable"] / kv["MemTotal"])
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+class ConcurrencyController:
+    """限制同时压制的任务数; adaptive=True 时后台自动调整上限
+
+    bus: ProgressBus, 用于计算总速度 (内容秒/墙钟秒, 即总实时倍率)
+    backlog(): 是否还有排队的任务, 没有时速度下降不代表并发不合适, 不做调整
+    """
+    GROW_CPU = 85.0      # CPU 低于此值才尝试加并发
+    HIGH_MEM = 90.0      # 内存高于此值减并发
+    MIN_GAIN = 1.05      # 加并发后速度至少提升 5% 才保留
+    COOLDOWN = 300.0     # 退回后这段时间内不再尝试同一并发数
+
+    def __init__(self, bus, limit, max_workers, adaptive=False, interval=15.0, backlog=lambda: True, log=lambda msg: None):
+        self.bus = bus
+        self.max_workers = max(1, int(max_workers))
+        self.limit = max(1, min(int(limit), self.max_workers))
+        self.adaptive = adaptive
+        self.interval = interval
+        self.backlog = backlog
+        self.log = log
+        self.cond = threading.Condition()
+        self.busy = set()     # 正在使用的名额编号
+        self.closed = False
+        self.decisions = []   # (时间, 旧并发, 新并发, 原因)
+        self.ceiling = {}     # 并发数 -> 在此之前不再尝试
+        if adaptive: threading.Thread(target=self.tune, daemon=True).start()
+
+    def acquire(self):
+        """等待一个名额, 返回名额编号 (0..limit-1); 已关闭时返回 None"""
+        with self.cond:
+            while not self.closed and len(self.busy) >= self.limit:
+                self.cond.wait()
+            if self.closed: return None
+            slot = min(i for i in range(self.limit) if i not in self.busy)
+            self.busy.add(slot)
+            return slot
+
+    def release(self, slot):
+        with self.cond:
+            self.busy.discard(slot); self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True; self.cond.notify_all()
+
+    def set_limit(self, new, reason):
+        old = self.limit
+        with self.cond:
+            self.limit = new; self.cond.notify_all()
+        self.decisions.append((time.time(), old, new, reason))
+        self.log(f"并发 {old} -> {new}: {reason}")
+
+    def tune(self):
+        if HAS_PSUTIL: psutil.cpu_percent(None)  # 第一次调用只建立基准
+        done, _, _, _ = self.bus.snapshot(); t = time.time()
+        prev_rate = None; last_action = None
+        while not self.closed:
+            time.sleep(self.interval)
+            if self.closed: return
+            now_done, _, _, _ = self.bus.snapshot(); now = time.time()
+            rate = (now_done - done) / max(now - t, 1e-6)
+            done, t = now_done, now
+            cpu, mem = cpu_load(), memory_load()
+            if not self.backlog():
+                prev_rate = None; last_action = None; continue  # 队列已空, 收尾阶段不调整
+            stats = f"速度 {rate:.2f}x, CPU {'--' if cpu is None else f'{cpu:.0f}%'}, 内存 {'--' if mem is None else f'{mem:.0f}%'}"
+            if mem is not None and mem > self.HIGH_MEM and self.limit > 1:
+                self.set_limit(self.limit - 1, f"内存吃紧 ({stats})"); last_action = "shrink"
+            elif last_action == "grow" and prev_rate is not None and rate < prev_rate * self.MIN_GAIN:
+                self.ceiling[self.limit] = now + self.COOLDOWN
+                self.set_limit(self.limit - 1, f"加并发后未提速 ({prev_rate:.2f}x -> {stats}), 退回"); last_action = "revert"
+            elif (cpu is None or cpu < self.GROW_CPU) and self.limit < self.max_workers and self.ceiling.get(self.limit + 1, 0) < now:
+                self.set_limit(self.limit + 1, f"算力有余 ({stats})"); last_action = "grow"
+            else:
+                last_action = None
+            prev_rate = rate
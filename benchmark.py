@@ -0,0 +1,226 @@
+"""视频工厂性能基准
+
+用法:
+    python benchmark.py scene 输入1.mp4 [输入2.mp4 ...] [--ffmpeg PATH] [--hwaccel]
+    python benchmark.py threads [输入.mp4] [--workers 2 4 8] [--seconds 20] [--ffmpeg PATH]
+    python benchmark.py suite [--lengths 60 300 1200] [--concurrency 1 2 4] [--out result.json] [--ffmpeg PATH]
+    python benchmark.py compare 旧.json 新.json
+"""
+import os, json, random, platform, tempfile, argparse, bisect, time, subprocess, shutil
+from scene_detect import SCENE_PRESETS, detect_scenes, detect_scenes_parallel
+from media_probe import run_probe, ProbeCache
+from ffmpeg_runner import startupinfo
+from cpu_plan import partition_cpus, thread_args, pin_process
+from cut_planner import plan_fixed_cuts, plan_even_cuts
+from size_target import plan_splits, segment_bitrate, rate_args
+from encode import build_single_pass_cmd
+
+def drift_stats(reference, points, tolerance=1.0):
+    """以 reference 为基准, 统计 points 的切点漂移 (秒) 与召回率"""
+    if not reference:
+        return {"matched": 0, "recall": 1.0 if not points else 0.0, "mean_drift": 0.0, "max_drift": 0.0}
+    drifts = []
+    for r in reference:
+        i = bisect.bisect_left(points, r)
+        near = [abs(points[j] - r) for j in (i - 1, i) if 0 <= j < len(points)]
+        if near and min(near) <= tolerance: drifts.append(min(near))
+    return {"matched": len(drifts), "recall": len(drifts) / len(reference),
+            "mean_drift": sum(drifts) / len(drifts) if drifts else 0.0, "max_drift": max(drifts, default=0.0)}
+
+def bench_scene(args):
+    for path in args.inputs:
+        print(f"== {path}")
+        results = {}
+        for preset in SCENE_PRESETS:
+            t0 = time.perf_counter()
+            results[preset] = (detect_scenes(args.ffmpeg, path, preset, hwaccel=args.hwaccel and preset != "accurate"), time.perf_counter() - t0)
+        ref, ref_t = results["accurate"]
+        print(f"{'preset':<10}{'time(s)':>10}{'speedup':>9}{'cuts':>7}{'recall':>8}{'mean drift':>12}{'max drift':>11}")
+        for preset, (pts, t) in results.items():
+            st = drift_stats(ref, pts)
+            print(f"{preset:<10}{t:>10.2f}{ref_t / max(t, 1e-6):>8.1f}x{len(pts):>7}{st['recall']:>8.0%}{st['mean_drift']:>11.3f}s{st['max_drift']:>10.3f}s")
+
+def encode_fps(ffmpeg, source, seconds, workers, planned):
+    """同时启动 workers 个 libx264 压制, 返回总帧数 / 墙钟时间
+
+    planned=False 为原先的放任模式 (每个进程按全部核心开线程), True 为按份额限线程并绑核。
+    """
+    src = ["-f", "lavfi", "-i", "testsrc2=size=1920x1080:rate=30"] if source is None else ["-i", source]
+    slots = partition_cpus(workers) if planned else [None] * workers
+    procs = []
+    t0 = time.perf_counter()
+    for cpus in slots:
+        cmd = [ffmpeg, "-hide_banner", "-nostats", "-y"] + (["-threads", str(len(cpus))] if cpus else []) + src
+        cmd += ["-t", str(seconds), "-an", "-c:v", "libx264", "-preset", "medium", "-b:v", "6000k"]
+        cmd += (thread_args("libx264", len(cpus)) if cpus else []) + ["-progress", "pipe:1", "-f", "null", "-"]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, startupinfo=startupinfo())
+        if cpus: pin_process(p.pid, cpus)
+        procs.append(p)
+    frames = 0
+    for p in procs:
+        last = 0
+        for line in p.stdout:
+            if line.startswith("frame="):
+                try: last = int(line.split("=")[1])
+                except ValueError: pass
+        p.wait(); frames += last
+    return frames / max(time.perf_counter() - t0, 1e-6)
+
+def bench_threads(args):
+    print(f"源: {args.input or 'testsrc2 1080p30 (合成)'}, 每路 {args.seconds}s")
+    print(f"{'workers':<9}{'free fps':>10}{'planned fps':>13}{'gain':>8}")
+    for n in args.workers:
+        free = encode_fps(args.ffmpeg, args.input, args.seconds, n, False)
+        planned = encode_fps(args.ffmpeg, args.input, args.seconds, n, True)
+        print(f"{n:<9}{free:>10.1f}{planned:>13.1f}{planned / max(free, 1e-6) - 1:>+8.0%}")
+
+# --- 综合基准: 合成素材 + 各阶段耗时, 结果写 JSON 便于版本间对比 ---
+
+SYNTH_SOURCES = ["testsrc2", "mandelbrot", "smptebars", "rgbtestsrc", "testsrc", "smptehdbars"]
+
+def make_synthetic(ffmpeg, path, length, size="1280x720", rate=25, seed=0):
+    """生成 length 秒的测试视频: 轮流拼接不同 lavfi 画面, 拼接处就是已知的场景切换点
+
+    返回场景切换时间列表; 同一参数的视频已存在时直接复用。
+    """
+    rng = random.Random(f"{seed}-{length}")
+    bounds = []; t = 0.0
+    while True:
+        t += rng.uniform(8.0, 40.0)
+        if t >= length - 4.0: break
+        bounds.append(round(t * rate) / rate)  # 对齐到帧
+    meta = path + ".json"
+    if os.path.exists(path) and os.path.exists(meta):
+        with open(meta) as fp: return json.load(fp)["scenes"]
+    edges = [0.0] + bounds + [float(length)]
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y"]
+    for i, (a, b) in enumerate(zip(edges, edges[1:])):
+        cmd += ["-f", "lavfi", "-t", f"{b - a:.3f}", "-i", f"{SYNTH_SOURCES[i % len(SYNTH_SOURCES)]}=size={size}:rate={rate}"]
+    cmd += ["-f", "lavfi", "-t", str(length), "-i", "sine=frequency=440:sample_rate=48000"]
+    n = len(edges) - 1
+    chain = "".join(f"[{i}:v]format=yuv420p,setsar=1[v{i}];" for i in range(n)) + "".join(f"[v{i}]" for i in range(n))
+    cmd += ["-filter_complex", f"{chain}concat=n={n}:v=1:a=0[v]", "-map", "[v]", "-map", f"{n}:a",
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", "250", "-c:a", "aac", "-b:a", "128k", path]
+    subprocess.run(cmd, check=True, startupinfo=startupinfo())
+    with open(meta, "w") as fp: json.dump({"length": length, "scenes": bounds}, fp)
+    return bounds
+
+def timed(fn, *a, **kw):
+    t0 = time.perf_counter(); res = fn(*a, **kw)
+    return res, round(time.perf_counter() - t0, 6)
+
+def bench_engine_batch(ffmpeg, src, out_dir, concurrency):
+    """视频工厂 (engine.py) 端到端: 探测 + 场景检测 + 规划 + 压制"""
+    from engine import BatchEngine, Settings
+    # 每次都从空输出目录开始: 否则续跑日志会把上次的分段记为已完成, 测到的只是空跑;
+    # 探测缓存也不用用户共享的那份, 免得命中以往的结果
+    shutil.rmtree(out_dir, ignore_errors=True)
+    engine = BatchEngine(Settings(output_dir=out_dir, concurrency=concurrency, encoder="CPU", split_mode="fixed"), ffmpeg)
+    engine.probe_cache = ProbeCache(os.path.join(out_dir, ".probe_cache.json"))
+    result, elapsed = timed(engine.run, [(0, src)])
+    return {"result": result, "seconds": elapsed, "quarantined": len(engine.quarantine)}
+
+def bench_v5_encode(ffmpeg, src, out_dir, length, scenes, max_size_mb=450, bitrate_bps=6000000):
+    """converter_split_v5 的切分压制路径 (不启动界面): 按体积预算平分 + 单次解码输出"""
+    max_bytes = max_size_mb * 1024 * 1024
+    n = plan_splits(length, max_bytes, bitrate_bps)
+    cuts = plan_even_cuts(scenes, length, n) if n > 1 else [0.0, length]
+    bps = segment_bitrate(max(b - a for a, b in zip(cuts, cuts[1:])), max_bytes, bitrate_bps)
+    os.makedirs(out_dir, exist_ok=True)
+    cmd = build_single_pass_cmd(ffmpeg, src, out_dir, "bench", 1, cuts, ["-c:v", "libx264"] + rate_args(bps), "libx264")
+    _, elapsed = timed(subprocess.run, cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, startupinfo=startupinfo())
+    return {"segments": len(cuts) - 1, "seconds": elapsed}
+
+def bench_suite(args):
+    work = args.workdir or tempfile.mkdtemp(prefix="vf-bench-")
+    os.makedirs(work, exist_ok=True)
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": {"platform": platform.platform(), "cpus": os.cpu_count(), "python": platform.python_version()},
+              "ffmpeg": (subprocess.run([args.ffmpeg, "-version"], capture_output=True, text=True).stdout.splitlines() or [""])[0],
+              "revision": subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip(),
+              "results": []}
+
+    def emit(**rec):
+        report["results"].append(rec)
+        print(json.dumps(rec, ensure_ascii=False), flush=True)
+
+    for length in args.lengths:
+        src = os.path.join(work, f"synth_{length}s.mp4")
+        truth, gen_t = timed(make_synthetic, args.ffmpeg, src, length)
+        emit(stage="generate", length=length, seconds=gen_t, scenes=len(truth))
+
+        info, t = timed(run_probe, args.ffmpeg, src)
+        emit(stage="probe", length=length, mode="cold", seconds=t, duration=info["duration"])
+        cache = ProbeCache(os.path.join(work, f"probe_{length}.json")); cache.get(args.ffmpeg, src)
+        _, t = timed(cache.get, args.ffmpeg, src)
+        emit(stage="probe", length=length, mode="cached", seconds=t)
+
+        detected = {}
+        for preset in SCENE_PRESETS:
+            pts, t = timed(detect_scenes, args.ffmpeg, src, preset)
+            st = drift_stats(truth, pts)
+            detected[preset] = pts
+            emit(stage="scene", length=length, preset=preset, seconds=t, realtime=round(length / max(t, 1e-6), 2),
+                 cuts=len(pts), recall=round(st["recall"], 4), mean_drift=round(st["mean_drift"], 4), max_drift=round(st["max_drift"], 4))
+        pts, t = timed(detect_scenes_parallel, args.ffmpeg, src, length)
+        st = drift_stats(truth, pts)
+        emit(stage="scene", length=length, preset="accurate-parallel", seconds=t, realtime=round(length / max(t, 1e-6), 2),
+             cuts=len(pts), recall=round(st["recall"], 4), mean_drift=round(st["mean_drift"], 4), max_drift=round(st["max_drift"], 4))
+
+        scenes = detected["accurate"]
+        cuts, t = timed(plan_fixed_cuts, scenes, length, 270.0, 60.0)
+        emit(stage="plan", length=length, planner="fixed", seconds=t, cuts=len(cuts))
+        cuts, t = timed(plan_even_cuts, scenes, length, max(2, int(length // 600)))
+        emit(stage="plan", length=length, planner="even", seconds=t, cuts=len(cuts))
+
+        for j in args.concurrency:
+            rec = bench_engine_batch(args.ffmpeg, src, os.path.join(work, f"out_engine_{length}_{j}"), j)
+            emit(stage="batch", length=length, script="engine", concurrency=j, realtime=round(length / max(rec["seconds"], 1e-6), 2), **rec)
+        rec = bench_v5_encode(args.ffmpeg, src, os.path.join(work, f"out_v5_{length}"), length, scenes)
+        emit(stage="batch", length=length, script="v5", concurrency=1, realtime=round(length / max(rec["seconds"], 1e-6), 2), **rec)
+
+    out = args.out or f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, "w", encoding="utf-8") as fp: json.dump(report, fp, ensure_ascii=False, indent=1)
+    print(f"结果已写入 {out}")
+
+def record_key(rec):
+    return tuple((k, rec[k]) for k in ("stage", "length", "mode", "preset", "planner", "script", "concurrency") if k in rec)
+
+def bench_compare(args):
+    with open(args.old, encoding="utf-8") as fp: old = {record_key(r): r for r in json.load(fp)["results"]}
+    with open(args.new, encoding="utf-8") as fp: new = json.load(fp)["results"]
+    print(f"{'stage':<40}{'old(s)':>10}{'new(s)':>10}{'change':>9}")
+    for rec in new:
+        o = old.get(record_key(rec))
+        if not o or rec["stage"] == "generate": continue
+        label = " ".join(str(v) for _, v in record_key(rec))
+        print(f"{label:<40}{o['seconds']:>10.3f}{rec['seconds']:>10.3f}{rec['seconds'] / max(o['seconds'], 1e-6) - 1:>+9.0%}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="视频工厂性能基准")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("scene", help="场景检测: 各预设耗时与切点漂移 (以全解码为基准)")
+    sp.add_argument("inputs", nargs="+")
+    sp.add_argument("--ffmpeg", default="ffmpeg")
+    sp.add_argument("--hwaccel", action="store_true", help="非基准预设使用硬件解码")
+    sp.set_defaults(func=bench_scene)
+    tp = sub.add_parser("threads", help="并发 libx264 压制: 放任 vs 按核心切分绑核的总帧率")
+    tp.add_argument("input", nargs="?", default=None, help="输入视频 (默认使用合成测试源)")
+    tp.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    tp.add_argument("--seconds", type=float, default=20.0, help="每路压制的内容时长")
+    tp.add_argument("--ffmpeg", default="ffmpeg")
+    tp.set_defaults(func=bench_threads)
+    st = sub.add_parser("suite", help="合成素材上测量探测/场景检测/切点规划/压制各阶段, 输出 JSON")
+    st.add_argument("--lengths", type=int, nargs="+", default=[60, 300, 1200], help="合成视频时长 (秒)")
+    st.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4])
+    st.add_argument("--workdir", default=None, help="素材与输出目录 (默认临时目录, 指定后可复用生成的素材)")
+    st.add_argument("--out", default=None, help="JSON 结果文件")
+    st.add_argument("--ffmpeg", default="ffmpeg")
+    st.set_defaults(func=bench_suite)
+    cp = sub.add_parser("compare", help="对比两次 suite 的 JSON 结果")
+    cp.add_argument("old"); cp.add_argument("new")
+    cp.set_defaults(func=bench_compare)
+    args = ap.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 import customtkinter as ct
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import os, re, subprocess, threading, sys
+import os, re, threading, sys, bisect
+from ffmpeg_runner import supervisor
+from media_probe import shared_cache
+from scene_detect import detect_scenes_parallel
+from progress import ProgressBus
+from encode import build_single_pass_cmd, build_copy_cmd, can_stream_copy, snap_to_keyframes, parse_bitrate
+from cut_planner import plan_even_cuts
+from size_target import SizeModel, SIZE_SAFETY, plan_splits, segment_bitrate, rate_args
 
 # --- 1. 拖拽根窗口初始化 ---
 try:
@@ -39,6 +46,10 @@ class VideoConverterApp:
         self.output_dir = tk.StringVar()
         self.bitrate = tk.StringVar(value="6000k")
         self.max_size_mb = 450  # 限制大小 450MB
+        self.size_model = SizeModel()  # 按真实输出体积校准的码率比例
+        self.bus = ProgressBus()  # 压制线程只写进度总线, 界面定时拉取
+        self.shown_version = -1
+        self.running = False
 
         # --- UI 布局 (保持原样) ---
         self.header = ct.CTkLabel(root, text="视频工厂", font=("微软雅黑", 22, "bold"))
@@ -132,46 +143,48 @@ class VideoConverterApp:
         if not items or not self.output_dir.get():
             messagebox.showwarning("提示", "请确保已添加文件夹并选择了输出路径")
             return
-        threading.Thread(target=self.run_process, daemon=True).start()
+        # 控件与 Tk 变量只在界面线程读写: 任务参数在这里取好再交给压制线程
+        folders = [(item, self.tree.item(item, "values")[0]) for item in items]
+        self.bitrate_text = self.bitrate.get()
+        self.start_btn.configure(state="disabled")
+        self.bus.reset(); self.shown_version = -1; self.running = True
+        threading.Thread(target=self.run_process, args=(folders, self.output_dir.get()), daemon=True).start()
+        self.poll_progress()
+
+    def ui(self, fn, *args, **kw):
+        # 压制线程更新界面一律经 after 投递到界面线程
+        self.root.after(0, lambda: fn(*args, **kw))
+
+    def reset_ui(self):
+        self.start_btn.configure(state="normal")
+        self.prog.set(0)
+        self.status_lbl.configure(text="就绪")
+
+    def poll_progress(self):
+        # 10Hz 拉取进度, 压制线程不直接操作控件
+        _, _, latest, version = self.bus.snapshot()
+        if latest is not None and version != self.shown_version:
+            self.shown_version = version; frac, text = latest
+            self.prog.set(frac); self.status_lbl.configure(text=text)
+        if self.running: self.root.after(100, self.poll_progress)
 
     def get_video_info(self, ffmpeg_exe, file_path):
-        si = subprocess.STARTUPINFO() if os.name == 'nt' else None
-        if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        res = subprocess.run([ffmpeg_exe, "-i", file_path], capture_output=True, text=True, errors='ignore', startupinfo=si)
-        dur_match = re.search(r"Duration:\s(\d+):(\d+):(\d+.\d+)", res.stderr)
-        if dur_match:
-            return (int(dur_match.group(1))*3600 + int(dur_match.group(2))*60 + float(dur_match.group(3)))
-        return 0
+        # 与视频工厂共用持久化探测缓存
+        return shared_cache().get_duration(ffmpeg_exe, file_path)
 
     def find_scene_cuts(self, ffmpeg_exe, file_path, threshold=0.3):
         """整合 videos_cut 的场景检测逻辑"""
-        cmd = [ffmpeg_exe, "-i", file_path, "-filter:v", f"select=gt(scene\\,{threshold}),showinfo", "-f", "null", "-"]
-        si = subprocess.STARTUPINFO() if os.name == 'nt' else None
-        if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        proc = subprocess.Popen(cmd, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, text=True, errors='ignore', startupinfo=si)
-        scenes = []
-        for line in proc.stdout:
-            if "pts_time:" in line:
-                match = re.search(r"pts_time:([0-9.]+)", line)
-                if match: scenes.append(float(match.group(1)))
-        return sorted(list(set(scenes)))
-
-    def run_process(self):
-        self.start_btn.configure(state="disabled")
+        dur = self.get_video_info(ffmpeg_exe, file_path)
+        return detect_scenes_parallel(ffmpeg_exe, file_path, dur, threshold=threshold)
+
+    def run_process(self, folders, out_base):
         ffmpeg_exe = get_ffmpeg_path()
-        out_base = self.output_dir.get()
-        items = self.tree.get_children()
 
-        # 提取码率数值用于计算 (例如 "6000k" -> 6000000)
-        try:
-            bitrate_val = int(re.search(r"(\d+)", self.bitrate.get()).group(1)) * 1000
-        except:
-            bitrate_val = 6000000
+        # 码率转 bps (例如 "6000k" / "6M" -> 6000000); 分段码率由它推算, 必须与 ffmpeg 的单位一致
+        bitrate_val = parse_bitrate(self.bitrate_text)
 
         try:
-            for item in items:
-                f_path = self.tree.item(item, "values")[0]
+            for item, f_path in folders:
                 files = sorted([f for f in os.listdir(f_path) if f.lower().endswith(".mp4")])
                 
                 # 全局集数偏移量
@@ -185,78 +198,101 @@ class VideoConverterApp:
                     in_p = os.path.join(f_path, filename)
                     dur = self.get_video_info(ffmpeg_exe, in_p)
                     
-                    # 预估大小 (Bytes) = (码率 + 音频约192k) * 时长 / 8
-                    est_size_mb = ((bitrate_val + 192000) * dur) / (8 * 1024 * 1024)
+                    # 源已是目标编码且码率达标: 直接复制流, 输出大小约等于源文件
+                    info = shared_cache().get(ffmpeg_exe, in_p)
+                    v_codec = self.video_codec(); max_bytes = self.max_size_mb * 1024 * 1024
+                    copy_ok = can_stream_copy(info, v_codec, bitrate_val)
+                    copy_audio = copy_ok and info["audio_codec"] == "aac"
                     
                     save_dir = os.path.join(out_base, name)
                     os.makedirs(save_dir, exist_ok=True)
 
                     # --- 核心切分逻辑 ---
-                    num_splits = int(est_size_mb // self.max_size_mb) + (1 if est_size_mb % self.max_size_mb > 0 else 0)
+                    if copy_ok:
+                        est_size_mb = os.path.getsize(in_p) / (1024 * 1024)
+                        num_splits = int(est_size_mb // self.max_size_mb) + (1 if est_size_mb % self.max_size_mb > 0 else 0)
+                    else:
+                        # 按体积上限反推: 允许适当降码率时最少需要几段
+                        num_splits = plan_splits(dur, max_bytes, bitrate_val, self.size_model.ratio(v_codec))
                     
                     if num_splits > 1:
-                        self.status_lbl.configure(text=f"检测到超大文件，正在分析断点: {filename}")
+                        self.ui(self.status_lbl.configure, text=f"检测到超大文件，正在分析断点: {filename}")
                         scene_points = self.find_scene_cuts(ffmpeg_exe, in_p)
                         
-                        # 根据大小平分时间点
-                        target_dur = dur / num_splits
-                        cut_points = [0.0]
-                        last_point = 0.0
-                        
-                        for _ in range(num_splits - 1):
-                            ideal_time = last_point + target_dur
-                            # 找最接近理想切分点的场景断点
-                            best_point = min(scene_points, key=lambda x: abs(x - ideal_time)) if scene_points else ideal_time
-                            cut_points.append(best_point)
-                            last_point = best_point
-                        cut_points.append(dur)
+                        # 根据大小平分时间点, 每个切点取最接近理想位置的场景断点
+                        cut_points = plan_even_cuts(scene_points, dur, num_splits)
+
+                        if copy_ok:
+                            # 切点吸附到关键帧; 有切点吸附不到时整片回退为重新压制
+                            keyframes = shared_cache().get(ffmpeg_exe, in_p, keyframes=True)["keyframes"]
+                            snapped, aligned = snap_to_keyframes(cut_points, keyframes)
+                            if all(aligned): cut_points = snapped
+                            else: copy_ok = False
                         
-                        # 执行分段压制
-                        for i in range(len(cut_points)-1):
-                            start_t = cut_points[i]
-                            segment_dur = cut_points[i+1] - start_t
-                            curr_ep = raw_ep + episode_offset
-                            out_p = os.path.join(save_dir, f"{name}-第{curr_ep}集.mp4")
-                            
-                            self.convert_video(ffmpeg_exe, in_p, out_p, start_t, segment_dur, name, curr_ep)
-                            if i < len(cut_points)-2:
-                                episode_offset += 1 # 只有切分出的段落才增加偏移
+                        # 单次解码, 一次写出全部分段; 码率按最长一段的体积预算
+                        first_ep = raw_ep + episode_offset
+                        seg_bps = None if copy_ok else segment_bitrate(max(b - a for a, b in zip(cut_points, cut_points[1:])), max_bytes, bitrate_val, self.size_model.ratio(v_codec))
+                        self.convert_segments(ffmpeg_exe, in_p, save_dir, cut_points, name, first_ep, copy_ok, copy_audio, seg_bps)
+                        if seg_bps: self.enforce_size_cap(ffmpeg_exe, in_p, save_dir, name, first_ep, cut_points, v_codec, seg_bps)
+                        episode_offset += len(cut_points) - 2 # 只有切分出的段落才增加偏移
                     else:
                         # 正常压制
                         curr_ep = raw_ep + episode_offset
                         out_p = os.path.join(save_dir, f"{name}-第{curr_ep}集.mp4")
-                        self.convert_video(ffmpeg_exe, in_p, out_p, 0, dur, name, curr_ep)
+                        seg_bps = None if copy_ok else segment_bitrate(dur, max_bytes, bitrate_val, self.size_model.ratio(v_codec))
+                        self.convert_video(ffmpeg_exe, in_p, out_p, 0, dur, name, curr_ep, copy_ok, copy_audio, seg_bps)
+                        if seg_bps: self.enforce_size_cap(ffmpeg_exe, in_p, save_dir, name, curr_ep, [0.0, dur], v_codec, seg_bps)
 
-                    self.tree.item(item, values=(f_path, f"进行中 ({f_idx+1}/{len(files)})"))
+                    self.ui(self.tree.item, item, values=(f_path, f"进行中 ({f_idx+1}/{len(files)})"))
 
-                self.tree.item(item, values=(f_path, "已完成 √"))
-            messagebox.showinfo("任务结束", "所有视频已压制并自动切分完成！")
+                self.ui(self.tree.item, item, values=(f_path, "已完成 √"))
+            self.ui(messagebox.showinfo, "任务结束", "所有视频已压制并自动切分完成！")
         except Exception as e:
-            messagebox.showerror("运行异常", str(e))
+            self.ui(messagebox.showerror, "运行异常", str(e))
         finally:
-            self.start_btn.configure(state="normal")
-            self.prog.set(0)
-            self.status_lbl.configure(text="就绪")
-
-    def convert_video(self, ffmpeg_exe, in_p, out_p, start, duration, name, ep):
+            shared_cache().flush()
+            self.running = False; self.bus.reset()
+            self.ui(self.reset_ui)
+
+    def video_codec(self):
+        # 默认使用 CPU 编码 (libx264), Mac 尝试使用硬件加速 (VideoToolbox)
+        return "h264_videotoolbox" if sys.platform == "darwin" else "libx264"
+
+    def enforce_size_cap(self, ffmpeg_exe, in_p, save_dir, name, first_ep, cut_points, v_codec, video_bps, retries=2):
+        """用真实体积校准码率模型; 仍超限的分段按超出比例降码率单独重压"""
+        max_bytes = self.max_size_mb * 1024 * 1024
+        for i, (start, end) in enumerate(zip(cut_points, cut_points[1:])):
+            ep = first_ep + i; out_p = os.path.join(save_dir, f"{name}-第{ep}集.mp4"); bps = video_bps
+            try: size = os.path.getsize(out_p)
+            except OSError: continue
+            self.size_model.observe(v_codec, end - start, bps, size)
+            for _ in range(retries):
+                if size <= max_bytes: break
+                bps = int(bps * max_bytes * SIZE_SAFETY / size)
+                self.convert_video(ffmpeg_exe, in_p, out_p, start, end - start, name, ep, video_bps=bps)
+                try: size = os.path.getsize(out_p)
+                except OSError: break
+
+    def convert_segments(self, ffmpeg_exe, in_p, save_dir, cut_points, name, first_ep, copy=False, copy_audio=False, video_bps=None):
+        """整片只解码一次: 在切点强制关键帧, 由 segment 复用器按 `{name}-第{ep}集.mp4` 写出各段"""
+        video_codec = "copy" if copy else self.video_codec()
+        video_args = ["-c:v", "copy"] if copy else ["-c:v", video_codec] + (rate_args(video_bps) if video_bps else ["-b:v", self.bitrate_text])
+        cmd = build_single_pass_cmd(ffmpeg_exe, in_p, save_dir, name, first_ep, cut_points, video_args, video_codec,
+                                    ["-c:a", "copy"] if copy_audio else None)
+        inner = cut_points[1:-1]
+        return self.run_ffmpeg(cmd, cut_points[-1], lambda cur: f"正在压制(单次解码)：{name} - 第{first_ep + bisect.bisect_right(inner, cur)}集")
+
+    def convert_video(self, ffmpeg_exe, in_p, out_p, start, duration, name, ep, copy=False, copy_audio=False, video_bps=None):
         """修复音频错位并适配 Apple Silicon (M1/M2/M3/M4) 硬件加速"""
-        si = subprocess.STARTUPINFO() if os.name == 'nt' else None
-        if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        # 默认使用 CPU 编码 (libx264)
-        video_codec = "libx264"
-        
-        # 如果是 Mac，尝试使用硬件加速 (VideoToolbox)
-        if sys.platform == "darwin":
-            video_codec = "h264_videotoolbox"
+        video_codec = self.video_codec()
 
-        cmd = [
-            ffmpeg_exe, "-y", 
+        cmd = build_copy_cmd(ffmpeg_exe, in_p, out_p, start, duration, copy_audio) if copy else [
+            ffmpeg_exe, "-y", "-nostats",
             "-ss", str(start), 
             "-t", str(duration), 
             "-i", in_p, 
             "-c:v", video_codec,  # 动态选择编码器
-            "-b:v", self.bitrate.get(), 
+            *(rate_args(video_bps) if video_bps else ["-b:v", self.bitrate_text]),
             "-c:a", "aac", "-b:a", "192k", 
             "-avoid_negative_ts", "make_zero",
             "-movflags", "+faststart",
@@ -264,18 +300,15 @@ class VideoConverterApp:
             out_p
         ]
         
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                universal_newlines=True, encoding='utf-8', errors='ignore', startupinfo=si)
-
-        for line in proc.stdout:
-            t_match = re.search(r"time=(\d+):(\d+):(\d+.\d+)", line)
-            if t_match and duration > 0:
-                h, m, s = t_match.groups()
-                cur = int(h)*3600 + int(m)*60 + float(s)
-                self.prog.set(min(cur / duration, 1.0))
-                self.status_lbl.configure(text=f"正在压制(M4加速版)：{name} - 第{ep}集")
-                self.root.update_idletasks()
-        proc.wait()
+        return self.run_ffmpeg(cmd, duration, lambda cur: f"正在压制(M4加速版)：{name} - 第{ep}集")
+
+    def run_ffmpeg(self, cmd, duration, label_at):
+        """交给进程监管器运行, 从 -progress 块取已压制秒数推进度; label_at(秒) -> 状态文字"""
+        def on_progress(block):
+            try: cur = int(block["out_time_ms"]) / 1000000
+            except (KeyError, ValueError): return
+            if duration > 0: self.bus.update("seg", cur, (min(cur / duration, 1.0), label_at(cur)))
+        return supervisor().run(cmd, on_progress=on_progress)
 
 if __name__ == "__main__":
     root = RootWindow()
@@ -0,0 +1,79 @@
+import os, glob
+
+# --- CPU 资源规划 ---
+# 多个 libx264 同时跑时, 每个进程默认按全部核心开线程, 互相抢核、抢缓存。
+# 这里把可用核心 (有 NUMA 时按节点) 切成 N 份, 每个压制进程固定在自己那份上,
+# 线程数也按份额设置。Linux 用 sched_setaffinity, 其他平台有 psutil 时用它绑核。
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+CPU_ENCODERS = ("libx264", "libx265")
+
+def parse_cpulist(text):
+    """解析 /sys 的 cpulist 格式: "0-3,8-11" -> [0, 1, 2, 3, 8, 9, 10, 11]"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part: continue
+        lo, _, hi = part.partition("-")
+        cpus += range(int(lo), int(hi or lo) + 1)
+    return cpus
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"): return sorted(os.sched_getaffinity(0))
+    if HAS_PSUTIL:
+        try: return sorted(psutil.Process().cpu_affinity())
+        except (AttributeError, psutil.Error): pass
+    return list(range(os.cpu_count() or 1))
+
+def numa_nodes(cpus=None):
+    """返回各 NUMA 节点上的可用核心列表; 不是 NUMA 机器或无法读取时只有一组"""
+    cpus = cpus if cpus is not None else available_cpus()
+    allowed = set(cpus); nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        try:
+            with open(path) as fp: node = [c for c in parse_cpulist(fp.read()) if c in allowed]
+        except (OSError, ValueError): continue
+        if node: nodes.append(node)
+    return nodes or [list(cpus)]
+
+def partition_cpus(workers, cpus=None, nodes=None):
+    """把核心分成 workers 份; 每份尽量不跨 NUMA 节点
+
+    按节点核心数比例分配份数, 节点内再均分; 份数多于核心时多个进程共享同一核心。
+    """
+    workers = max(1, int(workers))
+    nodes = nodes or numa_nodes(cpus)
+    total = sum(len(n) for n in nodes)
+    # 最大余数法: 各节点分到的份数与其核心数成比例, 且每个节点至少一份 (份数够时)
+    quota = [workers * len(n) / total for n in nodes]
+    counts = [int(q) for q in quota]
+    for i in sorted(range(len(nodes)), key=lambda i: quota[i] - counts[i], reverse=True)[:workers - sum(counts)]:
+        counts[i] += 1
+    slots = []
+    for node, k in zip(nodes, counts):
+        for i in range(k):
+            if k > len(node): slots.append([node[i % len(node)]]); continue
+            slots.append(node[len(node) * i // k:len(node) * (i + 1) // k])
+    return slots
+
+def thread_args(v_codec, n):
+    """按份额限制编码线程数; lookahead 线程占编码线程的 1/4"""
+    if v_codec not in CPU_ENCODERS: return []
+    args = ["-threads", str(n)]
+    if v_codec == "libx264": args += ["-x264-params", f"lookahead-threads={max(1, n // 4)}"]
+    else: args += ["-x265-params", f"pools={n}"]
+    return args
+
+def pin_process(pid, cpus):
+    """把进程绑定到 cpus; 平台不支持时静默跳过, 返回是否成功"""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(pid, cpus); return True
+        if HAS_PSUTIL:
+            psutil.Process(pid).cpu_affinity(list(cpus)); return True
+    except Exception:
+        pass
+    return False
@@ -0,0 +1,60 @@
+import bisect
+
+# --- 切点规划 ---
+# 场景点排序一次, 之后每个切点只做 O(log n) 的 bisect 窗口查询;
+# 整片规划 O(n log n), 取代原先每个切点都扫描全部场景点的 O(n·k) 循环。
+# 选点规则与原实现逐项一致: 距离相同取较早的点。
+
+def _first_index(points, pred, guess):
+    """有序 points 中第一个满足单调条件 pred 的下标; guess 为 bisect 的近似结果, 这里按原比较式修正浮点误差"""
+    i = guess
+    while i > 0 and pred(points[i - 1]): i -= 1
+    while i < len(points) and not pred(points[i]): i += 1
+    return i
+
+def window(points, lo_pred, hi_pred, lo_guess, hi_guess):
+    """满足 lo_pred(p) 且 hi_pred(p) 的下标区间 [i, j)"""
+    i = _first_index(points, lo_pred, bisect.bisect_left(points, lo_guess))
+    j = _first_index(points, lambda p: not hi_pred(p), bisect.bisect_right(points, hi_guess))
+    return i, max(i, j)
+
+def nearest(points, target, i=0, j=None):
+    """points[i:j] 中离 target 最近的点, 距离相同取较早的; 区间为空返回 None"""
+    j = len(points) if j is None else j
+    if i >= j: return None
+    k = bisect.bisect_left(points, target, i, j)
+    if k == i: return points[i]
+    if k == j: return points[j - 1]
+    return points[k - 1] if abs(points[k - 1] - target) <= abs(points[k] - target) else points[k]
+
+def plan_fixed_cuts(scenes, dur, target_first, min_sec, step=60.0):
+    """固定时长模式: 首集在 target_first 之后的第一个场景点切, 之后每集约 step 秒, 尽量落在场景点上
+
+    返回 [0.0, c1, c2, ...] (不含结尾 dur)。
+    """
+    pts = sorted(scenes); cuts = [0.0]
+    tail_ok = lambda p: (dur - p) >= min_sec
+    if dur > target_first:
+        i, j = window(pts, lambda p: p >= target_first, tail_ok, target_first, dur - min_sec)
+        cuts.append(pts[i] if i < j else target_first)
+    while dur - cuts[-1] >= (min_sec * 1.5):
+        last_p = cuts[-1]; target_nxt = last_p + step
+        i, j = window(pts, lambda p: (p - last_p) >= min_sec, tail_ok, last_p + min_sec, dur - min_sec)
+        if min_sec <= 0: i = max(i, bisect.bisect_right(pts, last_p))  # 切点必须前进, 否则会死循环
+        best = nearest(pts, target_nxt, i, j)
+        if best is not None: cuts.append(best)
+        elif (dur - target_nxt) >= min_sec: cuts.append(target_nxt)
+        else: break
+    return cuts
+
+def plan_even_cuts(scenes, dur, num_splits):
+    """平分模式: 依次在 上一切点 + dur/num_splits 附近取最近的场景点; 返回含首尾的完整切点"""
+    pts = sorted(scenes); target_dur = dur / num_splits
+    cut_points = [0.0]; last_point = 0.0
+    for _ in range(num_splits - 1):
+        ideal_time = last_point + target_dur
+        best_point = nearest(pts, ideal_time)
+        last_point = ideal_time if best_point is None else best_point
+        cut_points.append(last_point)
+    cut_points.append(dur)
+    return cut_points
@@ -0,0 +1,323 @@
+"""视频工厂分布式模式: 一台协调机规划切点并分发分段, 多台工作机拉取任务压制
+
+协调机 (与普通批处理参数相同, 多一个 --serve):
+    python engine.py 输入目录 -o 输出目录 --serve 0.0.0.0:8765 [--lease-sec 60] [--token 口令]
+工作机 (输入/输出需在共享存储上, 路径不同时用 --map 协调机前缀=本机前缀):
+    python distributed.py worker http://协调机:8765 -j 2 [-e NVIDIA显卡] [--map /mnt/share=Z:\\share]
+
+协议为 JSON over HTTP:
+    POST /lease     {worker}                        -> {job} / {wait} / {done}
+    POST /progress  {lease, sec}                    -> {ok} / {cancel} (租约已过期被收回)
+    POST /complete  {lease, ok, error, wall, stats} -> {ok}
+    GET  /status
+工作机每隔几秒上报进度即续租; 超过 lease_sec 没有消息的租约被收回重新分配,
+每个租约写各自的临时文件 (成品名.租约号.part), 过期工作机迟到的结果直接丢弃。
+"""
+import os, sys, json, time, uuid, socket, heapq, argparse, itertools, threading, urllib.request, urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from engine import BatchEngine, Settings, RETRY_LIMIT, HW_ENCODER_TAGS, software_fallback, get_ffmpeg_path
+from journal import PART_SUFFIX
+
+LEASE_SEC = 60.0
+HEARTBEAT_SEC = 3.0
+JOB_FIELDS = ("kind", "file", "title", "ep", "start", "dur", "out", "outs", "save_path", "cuts", "copy_audio", "audio")
+
+
+class Coordinator:
+    def __init__(self, engine, host="0.0.0.0", port=8765, lease_sec=LEASE_SEC, token=""):
+        self.engine = engine
+        self.addr = (host, int(port))
+        self.lease_sec = lease_sec
+        self.token = token
+        self.lock = threading.Lock()
+        self.pending = []    # 堆: (-时长, 序号, 任务号), 最长任务优先
+        self.jobs = {}       # 任务号 -> 引擎的分段任务
+        self.attempts = {}   # 任务号 -> 已失败/过期次数
+        self.leases = {}     # 租约号 -> {"job", "worker", "deadline", "kind", "v_codec", "suffix"}
+        self.open_jobs = 0   # 尚未成功或最终失败的任务数
+        self.planning = True
+        self.seq = itertools.count()
+        self.workers = {}    # 工作机 -> 最近一次通信时间
+        self.expired = {}    # 已收回的租约号 -> 租约, 迟到的结果据此清理临时文件
+
+    # --- 任务分配 ---
+
+    def add_jobs(self, jobs):
+        with self.lock:
+            for job in jobs:
+                jid = uuid.uuid4().hex[:12]
+                self.jobs[jid] = job; self.open_jobs += 1
+                heapq.heappush(self.pending, (-job["dur"], next(self.seq), jid))
+                for o in job.get("outs", [job.get("out")]): self.engine.journal.mark_pending(o, job["file"])
+        return len(jobs)
+
+    def lease(self, worker):
+        with self.lock:
+            self.workers[worker] = time.time()
+            if not self.pending:
+                return {"wait": True, "retry": HEARTBEAT_SEC} if self.planning or self.open_jobs else {"done": True}
+            _, _, jid = heapq.heappop(self.pending)
+            job = self.jobs[jid]; n = self.attempts.get(jid, 0)
+            # 与单机重试相同的回退: 第二次重试起直接复制改为重新压制, 硬件编码器改用软件编码器
+            kind, v_codec = job["kind"], None
+            configured = self.engine.video_codec_args()[0]
+            if n >= 2 and kind == "copy": kind = "segment"
+            elif n >= 2 and any(t in configured for t in HW_ENCODER_TAGS): v_codec = software_fallback(configured)
+            lid = uuid.uuid4().hex
+            suffix = f".{lid[:8]}{PART_SUFFIX}"
+            self.leases[lid] = {"job": jid, "worker": worker, "deadline": time.time() + self.lease_sec, "kind": kind,
+                                "v_codec": v_codec or configured, "suffix": suffix, "started": time.time()}
+        s = self.engine.settings
+        spec = {k: job[k] for k in JOB_FIELDS if k in job}
+        if n >= 2: spec.pop("audio", None)  # 与单机重试一致, 改回逐段编码音频
+        spec.update(kind=kind, v_codec=v_codec, suffix=suffix, lease=lid, heartbeat=min(HEARTBEAT_SEC, self.lease_sec / 3),
+                    settings={"bitrate": s.bitrate, "encoder": s.encoder, "gpu_index": s.gpu_index})
+        return {"job": spec}
+
+    def progress(self, lid, sec):
+        with self.lock:
+            lease = self.leases.get(lid)
+            if not lease: return {"cancel": True}
+            lease["deadline"] = time.time() + self.lease_sec
+            self.workers[lease["worker"]] = time.time()
+            job = self.jobs[lease["job"]]
+        self.engine.bus.update(self.engine.task_key(job), float(sec), (job["title"], job["ep"]))
+        return {"ok": True}
+
+    def complete(self, lid, ok, details="", wall=0.0, stats=None, encoder=None):
+        with self.lock: lease = self.leases.pop(lid, None); stale = self.expired.pop(lid, None)
+        if not lease:
+            if stale:  # 租约已被收回, 任务已交给别的工作机; 丢弃迟到的临时文件
+                job = self.jobs[stale["job"]]
+                for o in job.get("outs", [job.get("out")]): self.engine.journal.discard(o + stale["suffix"])
+            return {"ok": False, "stale": True}
+        if encoder and lease["kind"] != "copy": lease["v_codec"] = encoder  # 工作机可用 -e 换成本机编码器
+        jid = lease["job"]; job = self.jobs[jid]; outs = job.get("outs", [job.get("out")])
+        if ok:
+            try:
+                for o in outs: self.engine.journal.commit(o + lease["suffix"], o, job["file"], job["signature"])
+            except OSError as e:
+                ok, details = False, f"提交失败: {e}"
+        self.settle(jid, lease, ok, details, wall, stats or {})
+        return {"ok": True}
+
+    def settle(self, jid, lease, ok, details, wall, stats):
+        """成功或重试用尽时交给引擎收尾; 否则放回队列, 由任意工作机重做"""
+        job = self.jobs[jid]
+        with self.lock:
+            n = self.attempts[jid] = self.attempts.get(jid, 0) + (0 if ok else 1)
+            final = ok or n > RETRY_LIMIT or self.engine.error_occurred
+            if final: self.open_jobs -= 1
+            else: heapq.heappush(self.pending, (-job["dur"], next(self.seq), jid))
+        if final:
+            self.engine.settle_job(job, ok, details, lease["kind"], lease["v_codec"], wall, n + 1, stats, lease["suffix"])
+        else:
+            for o in job.get("outs", [job.get("out")]): self.engine.journal.discard(o + lease["suffix"])
+            self.engine.bus.update(self.engine.task_key(job), 0.0)
+            self.engine.on_log(f"{job['title']} 第{job['ep']}集 在 {lease['worker']} 上失败, 重新排队 ({n}/{RETRY_LIMIT})")
+
+    def reap(self):
+        """收回过期租约"""
+        now = time.time()
+        with self.lock:
+            expired = [(lid, self.leases.pop(lid)) for lid, l in list(self.leases.items()) if l["deadline"] < now]
+            self.expired.update(expired)
+        for lid, lease in expired:
+            self.engine.on_log(f"{lease['worker']} 的租约已过期, 收回任务")
+            self.settle(lease["job"], lease, False, f"工作机 {lease['worker']} 超过 {self.lease_sec:.0f} 秒无响应", now - lease["started"], {})
+
+    def status(self):
+        done, total, _, _ = self.engine.bus.snapshot()
+        with self.lock:
+            return {"planning": self.planning, "pending": len(self.pending), "leased": len(self.leases), "open": self.open_jobs,
+                    "done_sec": round(done, 1), "total_sec": round(total, 1), "quarantined": len(self.engine.quarantine),
+                    "workers": {w: round(time.time() - t, 1) for w, t in self.workers.items()}}
+
+    # --- 主流程 ---
+
+    def serve(self, items, linger=10.0):
+        """规划 items 并分发, 全部分段结束后返回 "done" / "empty" / "error" """
+        engine = self.engine; engine.begin()
+        server = ThreadingHTTPServer(self.addr, type("Handler", (CoordinatorHandler,), {"coordinator": self}))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        engine.on_log(f"协调机已启动: http://{self.addr[0]}:{server.server_address[1]}")
+        planned = 0
+        try:
+            pending = []
+            for item_id, path in items:
+                files = engine.list_inputs(path)
+                info = {"id": item_id, "files": files, "total": len(files), "done": 0}
+                pending += [(f, info) for f in files]
+            engine.probe_total = len(pending)
+            # 与单机批处理相同的探测 -> 规划流水线, 规划好的分段进入分发队列而不是本机压制队列
+            planned = engine.plan_inputs(pending, self.add_jobs)
+            with self.lock: self.planning = False
+            while not engine.error_occurred:
+                with self.lock:
+                    if not self.open_jobs: break
+                self.reap(); time.sleep(1.0)
+            # 多留一会儿, 让轮询中的工作机收到 done 后自行退出
+            end = time.time() + linger
+            while time.time() < end and not engine.error_occurred and any(time.time() - t < HEARTBEAT_SEC * 2 for t in self.workers.values()):
+                time.sleep(0.5)
+        except Exception:
+            engine.error_occurred = True
+        finally:
+            server.shutdown(); server.server_close()
+            failed = engine.finish([])
+        if failed: return "error"
+        return "done" if planned or engine.quarantine else "empty"
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    coordinator = None
+
+    def reply(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def authorized(self):
+        token = self.coordinator.token
+        if token and self.headers.get("X-Token") != token:
+            self.reply(403, {"error": "token"}); return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized(): return
+        if self.path == "/status": self.reply(200, self.coordinator.status())
+        else: self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.authorized(): return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError:
+            self.reply(400, {"error": "bad json"}); return
+        c = self.coordinator
+        if self.path == "/lease": self.reply(200, c.lease(str(req.get("worker", self.client_address[0]))))
+        elif self.path == "/progress": self.reply(200, c.progress(req.get("lease"), req.get("sec", 0.0)))
+        elif self.path == "/complete":
+            self.reply(200, c.complete(req.get("lease"), bool(req.get("ok")), req.get("error", ""), float(req.get("wall", 0.0)),
+                                       req.get("stats"), req.get("encoder")))
+        else: self.reply(404, {"error": "not found"})
+
+    def log_message(self, *args):
+        pass
+
+
+# --- 工作机 ---
+
+class Worker:
+    def __init__(self, url, ffmpeg=None, name=None, slots=1, encoder=None, gpu_index=None, path_map=(), token="", poll=2.0):
+        self.url = url.rstrip("/")
+        self.ffmpeg = ffmpeg or get_ffmpeg_path()
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.slots = max(1, int(slots))
+        self.encoder = encoder
+        self.gpu_index = gpu_index
+        self.path_map = list(path_map)   # [(协调机前缀, 本机前缀)]
+        self.token = token
+        self.poll = poll
+        self.stopped = threading.Event()
+        self.engines = set()
+        self.done_count = 0
+
+    def call(self, path, payload):
+        req = urllib.request.Request(self.url + path, data=json.dumps(payload).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json", "X-Token": self.token})
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return json.loads(resp.read() or b"{}")
+
+    def map_path(self, p):
+        for src, dst in self.path_map:
+            if p.startswith(src): return dst + p[len(src):].replace("/", os.sep) if dst else p[len(src):]
+        return p
+
+    def run(self):
+        threads = [threading.Thread(target=self.loop, args=(i,), daemon=True) for i in range(self.slots)]
+        for t in threads: t.start()
+        try:
+            while any(t.is_alive() for t in threads): time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for t in threads: t.join()
+        return self.done_count
+
+    def stop(self):
+        self.stopped.set()
+        for e in list(self.engines): e.stop()
+
+    def loop(self, slot):
+        me = f"{self.name}#{slot}"; failures = 0; contacted = False
+        while not self.stopped.is_set():
+            try:
+                r = self.call("/lease", {"worker": me}); failures = 0; contacted = True
+            except (urllib.error.URLError, OSError, ValueError):
+                failures += 1
+                if contacted and failures * self.poll > LEASE_SEC: return  # 协调机已结束或失联
+                self.stopped.wait(self.poll); continue
+            if r.get("done"): return
+            if "job" not in r:
+                self.stopped.wait(r.get("retry", self.poll)); continue
+            self.execute(r["job"])
+
+    def execute(self, spec):
+        s = spec["settings"]
+        engine = BatchEngine(Settings(bitrate=s["bitrate"], encoder=self.encoder or s["encoder"], cpu_pinning=False,
+                                      gpu_index=self.gpu_index if self.gpu_index is not None else s["gpu_index"]), self.ffmpeg)
+        self.engines.add(engine)
+        job = dict(spec, ffmpeg=self.ffmpeg, file=self.map_path(spec["file"]))
+        if "out" in job: job["out"] = self.map_path(job["out"])
+        if "save_path" in job: job["save_path"] = self.map_path(job["save_path"])
+        if job.get("audio"): job["audio"] = self.map_path(job["audio"])
+        os.makedirs(job["save_path"] if "save_path" in job else os.path.dirname(job["out"]), exist_ok=True)
+
+        lid = spec["lease"]; lost = threading.Event()
+        def heartbeat():
+            while not lost.wait(spec["heartbeat"]):
+                try:
+                    if self.call("/progress", {"lease": lid, "sec": engine.bus.snapshot()[0]}).get("cancel"):
+                        engine.stop(); return   # 租约已被收回, 放弃本任务
+                except (urllib.error.URLError, OSError, ValueError):
+                    pass
+        hb = threading.Thread(target=heartbeat, daemon=True); hb.start()
+        t0 = time.perf_counter()
+        try:
+            ok, details = engine.owned(engine.encode_attempt)(job, spec["kind"], spec.get("v_codec"), None, spec["suffix"])
+        except OSError as e:
+            ok, details = False, str(e)
+        lost.set(); self.engines.discard(engine)
+        stats = engine.proc_stats.pop(engine.task_key(job), {})
+        try:
+            self.call("/complete", {"lease": lid, "ok": ok, "error": details, "wall": time.perf_counter() - t0, "stats": stats,
+                                    "encoder": engine.video_codec_args(spec.get("v_codec"))[0]})
+            if ok: self.done_count += 1
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="视频工厂分布式工作机")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    wp = sub.add_parser("worker", help="从协调机拉取分段任务并压制")
+    wp.add_argument("url", help="协调机地址, 如 http://10.0.0.5:8765")
+    wp.add_argument("-j", "--slots", type=int, default=1, help="本机同时压制的任务数")
+    wp.add_argument("-e", "--encoder", default=None, help="本机使用的编码器 (默认沿用协调机设置)")
+    wp.add_argument("--gpu", default=None, help="本机 GPU 编号")
+    wp.add_argument("--map", action="append", default=[], help="路径映射 协调机前缀=本机前缀, 可多次指定")
+    wp.add_argument("--name", default=None, help="工作机名称")
+    wp.add_argument("--token", default="", help="与协调机一致的口令")
+    wp.add_argument("--ffmpeg", default=None)
+    args = ap.parse_args(argv)
+    path_map = [tuple(m.split("=", 1)) for m in args.map if "=" in m]
+    worker = Worker(args.url, args.ffmpeg, args.name, args.slots, args.encoder, args.gpu, path_map, args.token)
+    print(f"工作机 {worker.name} 已连接 {worker.url}, 并发 {worker.slots}", flush=True)
+    n = worker.run()
+    print(f"工作机退出, 共完成 {n} 个任务", flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
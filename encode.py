@@ -0,0 +1,71 @@
+import os, re, bisect
+from audio_track import AUDIO_ARGS, SEGMENT_AUDIO_MAP, audio_input_args
+
+# --- 压制命令构造 ---
+
+COPY_SNAP_TOLERANCE = 2.0  # 切点吸附到关键帧的最大偏移 (秒)
+
+def parse_bitrate(text, default=6000000):
+    """码率字符串转 bps: 6000k / 6M / 6000000"""
+    m = re.match(r"\s*([\d.]+)\s*([kKmM]?)", text or "")
+    if not m: return default
+    return int(float(m.group(1)) * {"": 1, "k": 1000, "m": 1000000}[m.group(2).lower()])
+
+def codec_family(v_codec):
+    if "264" in v_codec: return "h264"
+    if "265" in v_codec or "hevc" in v_codec: return "hevc"
+    return v_codec
+
+def can_stream_copy(info, v_codec, bitrate_bps):
+    """源视频已是目标编码且码率不高于目标码率时, 重新压制没有意义"""
+    if not info or info.get("video_codec") != codec_family(v_codec): return False
+    src_bps = info.get("video_bitrate") or info.get("bitrate") or 0
+    return 0 < src_bps <= bitrate_bps * 1.05
+
+def snap_to_keyframes(cuts, keyframes, tolerance=COPY_SNAP_TOLERANCE):
+    """把内部切点吸附到 tolerance 内最近的关键帧
+
+    返回 (新切点, 每段起点是否落在关键帧上); 吸附不到的切点保持原值, 该段需重新压制。
+    """
+    out = [cuts[0]]; aligned = [True]
+    for c in cuts[1:-1]:
+        i = bisect.bisect_left(keyframes, c)
+        near = [keyframes[j] for j in (i - 1, i) if 0 <= j < len(keyframes)]
+        k = min(near, key=lambda x: abs(x - c)) if near else None
+        if k is not None and abs(k - c) <= tolerance and out[-1] < k < cuts[-1]:
+            out.append(k); aligned.append(True)
+        else:
+            out.append(c); aligned.append(False)
+    out.append(cuts[-1])
+    return out, aligned
+
+def build_copy_cmd(ffmpeg, in_p, out_p, start, dur, copy_audio=True, audio_p=None):
+    # 输出可能是 .part 临时文件, 显式指定 mp4 容器
+    """关键帧对齐的分段直接复制流, 速度只受磁盘 I/O 限制; audio_p 为整片音频中间文件时从中截取音频"""
+    cmd = [ffmpeg, "-y", "-nostats", "-ss", str(round(start, 3)), "-t", str(round(dur, 3)), "-i", in_p]
+    if audio_p: cmd += audio_input_args(audio_p, start, dur) + ["-c:v", "copy"] + SEGMENT_AUDIO_MAP
+    else: cmd += ["-c:v", "copy"] + (["-c:a", "copy"] if copy_audio else AUDIO_ARGS)
+    return cmd + ["-avoid_negative_ts", "make_zero", "-movflags", "+faststart", "-f", "mp4", "-progress", "pipe:1", out_p]
+
+def episode_pattern(save_dir, title, suffix=""):
+    """segment 复用器的输出模板, 与逐段压制的 `{title}-第{ep}集.mp4` 命名一致"""
+    return os.path.join(save_dir, f"{title.replace('%', '%%')}-第%d集.mp4{suffix}")
+
+def build_single_pass_cmd(ffmpeg, in_p, save_dir, title, first_ep, cuts, video_args, v_codec="", audio_args=None, suffix="", input_args=None):
+    """单次解码、一次写出所有分集
+
+    cuts 为 [0, c1, c2, ..., dur]: 在内部切点强制关键帧, 再由 segment 复用器
+    在这些时间点切文件, 音频也只解码/编码一遍。v_codec 为 "copy" 时不重新压制,
+    segment 复用器会在切点后的第一个关键帧处切开。
+    """
+    times = ",".join(f"{c:.3f}" for c in cuts[1:-1])
+    cmd = [ffmpeg, "-y", "-nostats"] + list(input_args or []) + ["-i", in_p] + list(video_args)
+    if times and v_codec != "copy":
+        cmd += ["-force_key_frames", times]
+        if "nvenc" in v_codec: cmd += ["-forced-idr", "1"]
+    cmd += list(audio_args or ["-c:a", "aac", "-b:a", "192k"]) + ["-avoid_negative_ts", "make_zero",
+            "-f", "segment", "-segment_format", "mp4", "-segment_format_options", "movflags=+faststart",
+            "-reset_timestamps", "1", "-segment_start_number", str(first_ep)]
+    if times: cmd += ["-segment_times", times]
+    cmd += ["-progress", "pipe:1", episode_pattern(save_dir, title, suffix)]
+    return cmd
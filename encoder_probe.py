@@ -0,0 +1,113 @@
+import os, json, time, shutil, threading
+from media_probe import default_cache_dir
+from atomic_file import write_atomic
+from journal import quick_checksum
+from ffmpeg_runner import supervisor
+
+# --- 编码器能力探测 ---
+# 用合成测试源实际压几秒, 能初始化的才算可用, 顺便测出帧率。
+# 结果按 ffmpeg 可执行文件的内容 (大小+抽样校验和) 缓存, 换了 ffmpeg 或过期才重新探测;
+# 不用路径: 单文件打包版每次启动都把 ffmpeg 解压到新的临时目录。
+# 被取消、超时或无法启动的探测只说明这次没测成, 不写入缓存。
+
+PROBE_VERSION = 2
+PROBE_MAX_AGE = 30 * 86400
+PROBE_SECONDS = 3
+PROBE_SOURCE = "testsrc2=size=1280x720:rate=30"
+
+def ffmpeg_fingerprint(ffmpeg):
+    path = shutil.which(ffmpeg) or ffmpeg
+    try:
+        return quick_checksum(path)
+    except OSError:
+        return None
+
+def probe_encoder(ffmpeg, v_codec, gpu_index="0", seconds=PROBE_SECONDS, timeout=60):
+    """试压 seconds 秒合成画面, 返回 {"ok", "fps", "error"}"""
+    cmd = [ffmpeg, "-hide_banner", "-nostats", "-f", "lavfi", "-i", PROBE_SOURCE, "-t", str(seconds), "-an", "-c:v", v_codec]
+    if "nvenc" in v_codec: cmd += ["-gpu", str(gpu_index)]
+    elif "qsv" in v_codec: cmd += ["-qsv_device", str(gpu_index)]
+    cmd += ["-b:v", "4000k", "-progress", "pipe:1", "-f", "null", "-"]
+    t0 = time.perf_counter(); frames = [0]
+    def on_progress(block):
+        if block.get("frame", "").strip().isdigit(): frames[0] = int(block["frame"])
+    try:
+        res = supervisor().run(cmd, on_progress=on_progress, timeout=timeout, tail=3)
+    except OSError as e:
+        return {"ok": False, "fps": 0.0, "error": str(e), "transient": True}
+    elapsed = time.perf_counter() - t0
+    if res.cancelled or res.timed_out:
+        return {"ok": False, "fps": 0.0, "error": "超时" if res.timed_out else "已取消", "transient": True}
+    if not res.ok or frames[0] <= 0:
+        return {"ok": False, "fps": 0.0, "error": res.error}
+    return {"ok": True, "fps": round(frames[0] / max(elapsed, 1e-6), 1), "error": ""}
+
+
+class EncoderProbe:
+    """后台探测 candidates ({显示名: 编码器}) 中哪些可用; 完成后调用 on_done(results)
+
+    results: {显示名: {"codec", "ok", "fps", "error"}}
+    """
+    def __init__(self, ffmpeg, candidates, gpu_index="0", cache_file=None):
+        self.ffmpeg = ffmpeg
+        self.candidates = dict(candidates)
+        self.gpu_index = str(gpu_index)
+        self.cache_file = cache_file or os.path.join(default_cache_dir(), "encoders.json")
+        self.results = None
+        self.done = threading.Event()
+        self.on_done = lambda results: None
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.results
+
+    def run(self, force=False):
+        fingerprint = ffmpeg_fingerprint(self.ffmpeg)
+        key = f"{fingerprint}|gpu{self.gpu_index}"
+        cached = {} if force else self.load().get(key, {})
+        results = {}
+        for label, codec in self.candidates.items():
+            e = cached.get(codec)
+            if not e or time.time() - e.get("probed_at", 0) > PROBE_MAX_AGE:
+                # 逐个探测: 同时压会互相抢 CPU/GPU, 测出的帧率没有可比性
+                e = dict(probe_encoder(self.ffmpeg, codec, self.gpu_index), probed_at=time.time())
+                if not e.pop("transient", False): cached[codec] = e
+            results[label] = dict(e, codec=codec)
+        if fingerprint: self.save(key, cached)
+        self.results = results
+        self.done.set()
+        self.on_done(results)
+        return results
+
+    def load(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            return data.get("entries", {}) if data.get("version") == PROBE_VERSION else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, key, entries):
+        # 顺带清掉所有结果都已过期的旧 ffmpeg 记录
+        now = time.time()
+        data = {k: v for k, v in self.load().items() if any(now - e.get("probed_at", 0) <= PROBE_MAX_AGE for e in v.values())}
+        data[key] = entries
+        try:
+            write_atomic(self.cache_file, json.dumps({"version": PROBE_VERSION, "entries": data}, ensure_ascii=False))
+        except OSError:
+            pass
+
+def rank_encoders(results):
+    """可用编码器按帧率从高到低排序的显示名列表"""
+    return [label for label, e in sorted(results.items(), key=lambda kv: -kv[1]["fps"]) if e["ok"]]
+
+def best_encoder(results, family=None):
+    """最快的可用编码器; family 为 "h264" / "hevc" 时只在该编码族中选"""
+    for label in rank_encoders(results):
+        codec = results[label]["codec"]
+        if family is None or (("265" in codec or "hevc" in codec) == (family == "hevc")): return label
+    return None
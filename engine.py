@@ -0,0 +1,750 @@
+"""视频工厂压制引擎 (不依赖任何 GUI 库, 可在无界面的 Linux 压制机上运行)
+
+命令行:
+    python engine.py 输入文件或目录... -o 输出目录 [-m fixed|auto] [-e CPU] [-j 2] [-b 6000k]
+"""
+import os, re, sys, json, time, bisect, queue, itertools, threading, argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from media_probe import shared_cache
+from ffmpeg_runner import supervisor
+from scene_detect import SCENE_PRESETS, detect_scenes_parallel, detect_scenes_window
+from progress import ProgressBus
+from media_index import shared_index, parse_exts, MEDIA_EXTS, DEFAULT_EXCLUDES
+from eta import EtaEstimator
+from metrics import Metrics, METRICS_NAME, PROM_NAME
+from journal import JobJournal, part_path, PART_SUFFIX
+from cpu_plan import CPU_ENCODERS, partition_cpus, thread_args, pin_process
+from cut_planner import plan_fixed_cuts, nearest
+from autoscale import ConcurrencyController
+from encoder_probe import EncoderProbe, best_encoder
+from audio_track import AUDIO_DIR, AUDIO_ARGS, SEGMENT_AUDIO_MAP, extract_audio, audio_input_args, remove_audio
+from encode import build_single_pass_cmd, build_copy_cmd, can_stream_copy, parse_bitrate, snap_to_keyframes
+
+ENCODER_MAP = {"CPU": "libx264", "Apple加速": "h264_videotoolbox", "NVIDIA显卡": "h264_nvenc", "Intel显卡": "h264_qsv", "AMD显卡": "h264_amf",
+               "CPU HEVC": "libx265", "Apple加速 HEVC": "hevc_videotoolbox", "NVIDIA显卡 HEVC": "hevc_nvenc",
+               "Intel显卡 HEVC": "hevc_qsv", "AMD显卡 HEVC": "hevc_amf"}
+HW_ENCODER_TAGS = ("nvenc", "qsv", "amf", "videotoolbox")
+RETRY_LIMIT = 2       # 单个分段失败后的最多重试次数; 第二次重试起硬件编码器回退到同格式的软件编码器
+RETRY_BACKOFF = 3.0   # 首次重试前等待秒数, 之后每次翻倍
+ENCODE_STALL_SEC = 300.0  # 压制进程这么久没有任何输出 (含 -progress) 视为卡死, 终止后按失败重试
+
+def software_fallback(v_codec):
+    """硬件编码器重试失败后改用的 CPU 编码器: HEVC 仍出 HEVC, 其余用 libx264"""
+    return "libx265" if "hevc" in v_codec else "libx264"
+
+def get_ffmpeg_path():
+    if getattr(sys, 'frozen', False):
+        base_path = sys._MEIPASS
+    else:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    ffmpeg_bin = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
+    local_ffmpeg = os.path.join(base_path, ffmpeg_bin)
+    return local_ffmpeg if os.path.exists(local_ffmpeg) else "ffmpeg"
+
+def get_platform_encoders():
+    """本平台可能支持的编码器; 实际能否使用由 start_encoder_probe 探测"""
+    if sys.platform == "darwin":
+        base = ["CPU", "Apple加速"]
+    else:
+        base = ["CPU", "NVIDIA显卡", "Intel显卡", "AMD显卡"]
+    return base + [f"{b} HEVC" for b in base]
+
+def start_encoder_probe(ffmpeg, gpu_index="0", on_done=None):
+    """后台探测各编码器能否初始化及其帧率 (结果有缓存), 返回 EncoderProbe"""
+    probe = EncoderProbe(ffmpeg, {l: ENCODER_MAP[l] for l in get_platform_encoders()}, gpu_index)
+    if on_done: probe.on_done = on_done
+    return probe.start()
+
+def parse_time_to_sec(t_str):
+    """分.秒 字符串转秒数, 如 4.30 -> 270"""
+    try: m, s = map(int, t_str.split('.')); return m * 60 + s
+    except: return 270
+
+def list_media(path, exts=MEDIA_EXTS, excludes=DEFAULT_EXCLUDES, skip=()):
+    """文件原样返回; 目录递归列出其中的媒体文件 (走共享索引, 未变化的子目录不重新列举)"""
+    return [path] if not os.path.isdir(path) else shared_index(exts, excludes).scan(path, skip=skip)
+
+def parse_episode_name(file_path):
+    """从文件名中解析 (起始集号, 剧名)"""
+    fname = os.path.basename(file_path); raw_ep = 1; title = os.path.splitext(fname)[0]
+    ep_match = re.search(r"第(\d+)集", fname)
+    start_num_match = re.match(r"^(\d+)", fname)
+    if ep_match:
+        raw_ep = int(ep_match.group(1)); title = re.sub(r"[-]?第\d+集", "", title).strip()
+    elif start_num_match:
+        raw_ep = int(start_num_match.group(1)); title = re.sub(r"^\d+[- ]*", "", title).strip()
+    return raw_ep, title
+
+
+class Settings:
+    """一次批处理的全部参数; GUI 在开始前从界面变量拷贝一份, 工作线程只读这里"""
+    output_dir = ""
+    bitrate = "6000k"
+    concurrency = 2
+    split_mode = "fixed"      # fixed: 固定时长 / auto: 整段输出
+    first_ep_time = "4.30"
+    min_segment_sec = 60.0
+    encoder = "CPU"           # ENCODER_MAP 的键, 或直接写 ffmpeg 编码器名
+    gpu_index = "0"
+    scene_preset = "accurate"
+    scene_hwaccel = False
+    scene_window = 0.0        # >0 时只在预定切点附近扫描场景
+    single_pass = False
+    copy_mode = False
+    cpu_pinning = True        # CPU 编码时按并发数切分核心并绑核
+    adaptive_concurrency = False  # 以 concurrency 为起点, 按总速度和 CPU/内存占用自动增减
+    max_concurrency = 0       # 自适应上限, 0 表示按核心数
+    media_exts = ".mp4 .mkv .mov"
+    exclude = ""              # 额外排除的文件/目录名通配符, 逗号分隔
+    metrics = True            # 各阶段耗时写入输出目录的 .jsonl 与 Prometheus 文本文件
+    prom_file = ""            # Prometheus 文本文件路径, 空则放在输出目录
+    shared_audio = True       # 每个源文件只处理一次音频, 各分段复制其中对应的一段
+
+    def __init__(self, **kw):
+        for k, v in kw.items():
+            if not hasattr(Settings, k): raise TypeError(f"未知参数: {k}")
+            setattr(self, k, v)
+
+
+class BatchEngine:
+    def __init__(self, settings, ffmpeg=None):
+        self.settings = settings
+        self.ffmpeg_path = ffmpeg or get_ffmpeg_path()
+        self.probe_cache = shared_cache()
+        self.task_lock = threading.Lock()
+        # 事件回调, 均在工作线程中触发; GUI 需自行转到主线程
+        # (压制进度不走回调, 由界面定时拉取 self.bus)
+        self.on_item_done = lambda item_id, path, done, total: None
+        self.on_failed = lambda entry: None  # 分段重试用尽、被隔离时触发
+        self.on_log = lambda msg: None       # 自适应并发等调度决策
+        self.reset()
+
+    def reset(self):
+        self.bus = ProgressBus()
+        self.eta = EtaEstimator()
+        self.scene_pending = 0.0     # 已探测、尚未规划切点的内容秒数 (等待场景检测)
+        self.scene_files = 0
+        self.planners = 1
+        self.controller = None
+        self.probe_total = 0
+        self.probe_done = 0
+        self.start_time = 0
+        self.journal = None
+        self.metrics = Metrics()     # 未开始时不落盘
+        self.proc_stats = {}         # 任务 -> ffmpeg -progress 最近一次的 speed/fps
+        self.quarantine = []   # 重试用尽的分段, 不影响其余任务
+        self.is_running = False
+        self.error_occurred = False
+        self.current_processes = []
+
+    def stop(self):
+        self.error_occurred = True
+        self.is_running = False
+        for job in list(self.current_processes): job.cancel()
+        self.current_processes = []
+        # 探测、场景检测、整片音频等进程不在 current_processes 里, 一并取消, 否则等待收尾会卡在它们上;
+        # 监管器全进程共用, 只取消本引擎名下的 (同进程的其他引擎、界面的编码器探测不受影响)
+        supervisor().cancel_all(self)
+
+    def owned(self, fn):
+        """包装交给引擎线程运行的函数: 其中启动的 ffmpeg 都记在本引擎名下"""
+        def run(*args, **kw):
+            with supervisor().owned_by(self): return fn(*args, **kw)
+        return run
+
+    def log_decision(self, msg):
+        # 调度决策写进指标 jsonl, 界面版 (--noconsole) 没有控制台也能事后查看
+        self.metrics.record("autoscale", message=msg, limit=self.controller.limit if self.controller else None)
+        self.on_log(msg)
+
+    def progress(self):
+        """返回 (完成比例, 总速度 (内容秒/墙钟秒), 剩余秒数); 数据不足时后两项为 None"""
+        total_done_sec, total, _, _ = self.bus.snapshot()
+        if total <= 0: return 0.0, None, None
+        self.eta.observe_progress(total_done_sec)
+        workers = self.controller.limit if self.controller else int(self.settings.concurrency)
+        rate, rem = self.eta.estimate(total_done_sec, total, workers, self.video_codec_args()[0],
+                                      self.scene_pending, self.scene_files, self.planners)
+        return total_done_sec / total, rate, rem
+
+    # --- 批处理 ---
+
+    def begin(self):
+        self.reset(); self.is_running = True; self.start_time = time.time()
+        os.makedirs(self.settings.output_dir, exist_ok=True)
+        self.journal = JobJournal(self.settings.output_dir)
+        if self.settings.metrics:
+            self.metrics = Metrics(os.path.join(self.settings.output_dir, METRICS_NAME),
+                                   self.settings.prom_file or os.path.join(self.settings.output_dir, PROM_NAME))
+        self.planners = max(2, min(4, os.cpu_count() or 2))
+
+    def input_filters(self):
+        s = self.settings
+        return parse_exts(s.media_exts), DEFAULT_EXCLUDES + tuple(p.strip() for p in s.exclude.split(",") if p.strip())
+
+    def list_inputs(self, path):
+        # 输出目录在输入树内时不把成品当输入
+        return list_media(path, *self.input_filters(), skip=[self.settings.output_dir])
+
+    def start_encoders(self):
+        """启动压制线程; 规划好的分段经 queue_jobs 进入共享优先队列 (最长任务优先)"""
+        s = self.settings
+        self.job_q = queue.PriorityQueue(); self.job_seq = itertools.count()
+        # 压制线程按上限启动, 由 controller 的名额决定实际同时压制数
+        n = int(s.concurrency)
+        hi = max(n, min(16, int(s.max_concurrency) or os.cpu_count() or n)) if s.adaptive_concurrency else n
+        self.controller = ConcurrencyController(self.bus, n, hi, s.adaptive_concurrency, backlog=lambda: self.job_q.qsize() > 0, log=self.log_decision)
+        self.cpu_slots = {}
+        workers = [threading.Thread(target=self.owned(self.encode_worker), args=(self.job_q,), daemon=True) for _ in range(hi)]
+        for w in workers: w.start()
+        return workers
+
+    def queue_jobs(self, jobs):
+        for job in jobs: self.job_q.put((-job["dur"], next(self.job_seq), job))
+        return len(jobs)
+
+    def finish(self, workers):
+        """等压制线程处理完队列后退出, 落盘缓存/日志/指标; 返回是否出错或被终止"""
+        # 哨兵排在所有分段之后, 队列清空后各压制线程退出
+        for _ in workers: self.job_q.put((float("inf"), next(self.job_seq), None))
+        for w in workers: w.join()
+        if self.controller: self.controller.close()
+        self.probe_cache.flush(); self.journal.flush(); self.metrics.close()
+        failed = self.error_occurred or not self.is_running
+        self.is_running = False
+        return failed
+
+    def run(self, items):
+        """items: [(item_id, 文件或目录路径)]; 返回 "done" / "empty" / "error" """
+        self.begin()
+        pending = []
+        for item_id, path in items:
+            files = self.list_inputs(path)
+            item_info = {"id": item_id, "files": files, "total": len(files), "done": 0}
+            pending += [(f, item_info) for f in files]
+        self.probe_total = len(pending); self.probe_done = 0
+
+        # 三级流水线: 探测 -> 规划切点 -> 分段压制
+        workers = self.start_encoders()
+        planned = 0
+        try:
+            planned = self.plan_inputs(pending, self.queue_jobs)
+        except Exception:
+            self.error_occurred = True
+        finally:
+            failed = self.finish(workers)
+
+        if failed: return "error"
+        # 续跑时分段可能全部已完成 (没有新入队的), 只要有文件规划成功或被隔离就不算 "没有有效视频"
+        return "done" if planned or self.quarantine else "empty"
+
+    def plan_inputs(self, pending, enqueue):
+        """pending: [(文件, item_info)]; 探测和规划各自在有界线程池中进行, 哪个文件先规划完
+        就先 enqueue(分段列表), 不等其余文件的探测; 返回规划成功的文件数 (含分段已全部完成、无需入队的)"""
+        ffmpeg = self.ffmpeg_path; planned = 0
+        with ThreadPoolExecutor(max_workers=min(8, max(2, os.cpu_count() or 2))) as prober, \
+             ThreadPoolExecutor(max_workers=self.planners) as planner:
+            probe_futs = {prober.submit(self.owned(self.probe_file), ffmpeg, f): (f, info) for f, info in pending}
+            plan_futs = {}; waiting = set(probe_futs)
+            while waiting:
+                done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+                if self.error_occurred:
+                    prober.shutdown(wait=False, cancel_futures=True); planner.shutdown(wait=False, cancel_futures=True); break
+                for fut in done:
+                    if fut in probe_futs:
+                        f, item_info = probe_futs[fut]; self.probe_done += 1
+                        try: d = fut.result()
+                        except Exception: d = 0
+                        if d > 0:
+                            self.bus.add_total(d)
+                            with self.task_lock: self.scene_pending += d; self.scene_files += 1
+                            p = planner.submit(self.owned(self.process_single_file), f, item_info, ffmpeg, None, d)
+                            plan_futs[p] = (f, item_info, d); waiting.add(p)
+                    else:
+                        f, item_info, d = plan_futs.pop(fut)
+                        try: jobs = fut.result()
+                        except Exception as e:
+                            self.plan_failed(f, item_info, d, e); continue
+                        enqueue(jobs); planned += 1
+        return planned
+
+    def watch(self, items, interval=10.0, stable_sec=30.0, max_inflight=0):
+        """常驻监视模式: 定期扫描 items 中的目录, 新文件 (或内容变化的文件) 的大小与修改时间
+        连续 stable_sec 秒不变才视为写完并入队; 同时在途的文件不超过 max_inflight 个
+        (默认并发数的 2 倍), 满了就暂不入队, 等已有文件压完。直到 stop() 才返回 "stopped"。
+        """
+        self.begin()
+        workers = self.start_encoders()
+        inflight = threading.BoundedSemaphore(int(max_inflight) or 2 * int(self.settings.concurrency))
+        roots = [(item_id, path, {"id": item_id, "files": [], "total": 0, "done": 0}) for item_id, path in items]
+        seen = {}; candidates = {}   # 已入队: 路径 -> 入队时的 stat; 待稳定: 路径 -> (stat, 首次看到该 stat 的时间)
+        try:
+            with ThreadPoolExecutor(max_workers=self.planners) as planner:
+                while not self.error_occurred:
+                    now = time.time(); full = False
+                    for item_id, path, item_info in roots:
+                        for f in self.list_inputs(path):
+                            # 原地改写不改变目录的修改时间, 索引里的 stat 不会刷新; 已入队的文件也要逐个 stat
+                            try: st = os.stat(f); sig = (st.st_size, st.st_mtime_ns)
+                            except OSError: continue
+                            if seen.get(f) == sig: continue
+                            c = candidates.get(f)
+                            if not c or c[0] != sig: candidates[f] = (sig, now); continue
+                            if sig[0] == 0 or now - c[1] < stable_sec or full: continue
+                            if not inflight.acquire(blocking=False):
+                                full = True; continue  # 背压: 在途文件已满, 下一轮再入队
+                            del candidates[f]; seen[f] = sig
+                            planner.submit(self.owned(self.ingest), f, item_info, inflight.release)
+                    if not self.sleep(interval): break
+        except Exception:
+            self.error_occurred = True
+        finally:
+            self.finish(workers)
+        return "stopped"
+
+    def ingest(self, file_path, item_info, release):
+        """监视模式下处理单个文件: 探测 -> 规划 -> 分段入队; 文件全部压完 (或无事可做) 时 release()"""
+        with self.task_lock:
+            if file_path in item_info["files"]:
+                # 原地改写后重新入队: 不重复计数, 重新压完之前不算已完成
+                finished = item_info.setdefault("finished", set())
+                finished.discard(file_path); item_info["done"] = len(finished)
+            else:
+                item_info["files"].append(file_path); item_info["total"] += 1
+            self.probe_total += 1
+        try:
+            d = self.probe_file(self.ffmpeg_path, file_path)
+        except Exception:
+            d = 0
+        self.probe_done += 1
+        if d <= 0 or self.error_occurred:
+            release(); return
+        self.bus.add_total(d)
+        with self.task_lock: self.scene_pending += d; self.scene_files += 1
+        try:
+            jobs = self.process_single_file(file_path, item_info, self.ffmpeg_path, release, d)
+        except Exception as e:
+            self.plan_failed(file_path, item_info, d, e, release); return
+        self.queue_jobs(jobs)
+
+    def plan_failed(self, file_path, item_info, dur, err, release=None):
+        """单个文件规划出错 (探测后被删除、场景检测失败等): 只隔离这个文件, 其余文件照常压制"""
+        if not self.error_occurred:
+            raw_ep, _ = parse_episode_name(file_path)
+            entry = {"file": file_path, "episodes": [raw_ep], "encoder": "切点规划", "error": str(err)}
+            with self.task_lock: self.quarantine.append(entry)
+            self.on_failed(entry)
+            self.metrics.record("plan", 0.0, file=file_path, duration=dur, status="failed", error=str(err))
+        self.bus.finish(f"{file_path}_plan", dur)  # 这部分时长不再计入剩余
+        self.file_finished({"path": file_path, "parent": item_info, "release": release})
+
+    def encode_worker(self, job_q):
+        while True:
+            slot = self.controller.acquire()
+            try:
+                _, _, job = job_q.get()
+                if job is None: return
+                if self.error_occurred: continue  # 手动终止后只清空队列, 不再压制
+                self.run_job(job, self.slot_cpus(slot))
+            finally:
+                if slot is not None: self.controller.release(slot)
+
+    def slot_cpus(self, slot):
+        """名额 -> 该名额独占的核心; 按当前并发数切分, 并发数变化后新任务按新切分绑核"""
+        if slot is None or not self.settings.cpu_pinning: return None
+        n = self.controller.limit
+        if n not in self.cpu_slots: self.cpu_slots[n] = partition_cpus(n)
+        return self.cpu_slots[n][min(slot, n - 1)]
+
+    def process_single_file(self, file_path, parent_task, ffmpeg, release=None, dur=None):
+        """为单个文件规划切点, 返回分段压制任务列表 (不在此处压制); dur 为探测阶段得到的时长
+
+        出错时抛出异常, 由调用方交给 plan_failed 隔离该文件。
+        """
+        if self.error_occurred: return []
+        s = self.settings
+        out_root = s.output_dir; dur = dur or self.get_video_duration(ffmpeg, file_path)
+        raw_ep, title = parse_episode_name(file_path)
+
+        try:
+            save_path = os.path.join(out_root, title); os.makedirs(save_path, exist_ok=True)
+            signature = self.job_signature()
+            planned = self.journal.lookup_plan(file_path, signature)
+            if planned:
+                # 续跑: 源文件和参数都没变, 直接沿用上次的切点
+                cuts, aligned = planned
+                info = self.probe_cache.get(ffmpeg, file_path) if any(aligned) else None
+                copy_audio = bool(info) and info["audio_codec"] == "aac"
+            else:
+                t0 = time.perf_counter()
+                cuts, aligned, copy_audio = self.plan_cuts(ffmpeg, file_path, dur)
+                self.journal.record_plan(file_path, signature, cuts, aligned)
+                self.metrics.record("plan", time.perf_counter() - t0, file=file_path, duration=dur, segments=len(cuts) - 1, copy_segments=sum(aligned))
+                self.eta.observe_scene(dur, time.perf_counter() - t0)
+        finally:
+            with self.task_lock: self.scene_pending -= dur; self.scene_files -= 1
+
+        # 同一文件的分段共享 file_state, 最后一段完成时更新列表进度
+        file_state = {"path": file_path, "parent": parent_task, "remaining": 0, "release": release}
+        base = {"file": file_path, "ffmpeg": ffmpeg, "title": title, "state": file_state, "signature": signature}
+        if s.single_pass and len(cuts) > 2 and not any(aligned):
+            jobs = [dict(base, kind="single_pass", ep=raw_ep, save_path=save_path, cuts=cuts, start=0.0, dur=cuts[-1],
+                         outs=[os.path.join(save_path, f"{title}-第{raw_ep + i}集.mp4") for i in range(len(cuts)-1)])]
+        else:
+            jobs = [dict(base, kind="copy" if aligned[i] else "segment", ep=raw_ep + i, start=cuts[i], dur=cuts[i+1] - cuts[i],
+                         out=os.path.join(save_path, f"{title}-第{raw_ep + i}集.mp4"), copy_audio=copy_audio) for i in range(len(cuts)-1)]
+
+        # 已完成且校验通过的分集直接跳过, 只重做缺失或半截的
+        todo = []
+        for job in jobs:
+            if all(self.journal.is_done(o, file_path, signature) for o in job.get("outs", [job.get("out")])):
+                self.bus.finish(self.task_key(job), job["dur"])
+            else:
+                todo.append(job)
+        file_state["remaining"] = len(todo)
+        if not todo: self.file_finished(file_state); return todo
+
+        # 逐段压制的分段共用一份整片音频 (单次解码模式本来就只编码一遍音频, 可复制音频的分段也不需要)
+        if s.shared_audio and any(j["kind"] == "segment" or not j.get("copy_audio", True) for j in todo):
+            audio = self.shared_audio_track(ffmpeg, file_path)
+            if audio:
+                file_state["audio"] = audio
+                for j in todo:
+                    if j["kind"] == "segment" or not j.get("copy_audio", True): j["audio"] = audio
+        return todo
+
+    def shared_audio_track(self, ffmpeg, file_path):
+        """生成 (或复用) 源文件的整片音频中间文件; 无音轨或失败时返回 None"""
+        info = self.probe_cache.get(ffmpeg, file_path)
+        if not info or not info["audio_codec"] or self.error_occurred: return None
+        t0 = time.perf_counter(); copy = info["audio_codec"] == "aac"
+        audio = extract_audio(ffmpeg, file_path, os.path.join(self.settings.output_dir, AUDIO_DIR), copy)
+        self.metrics.record("audio", time.perf_counter() - t0, file=file_path, duration=info["duration"], copy=copy, ok=bool(audio))
+        return audio
+
+    def job_signature(self):
+        """影响切点与成品内容的参数; 任一变化都会让日志中的旧记录失效"""
+        s = self.settings
+        return json.dumps([s.bitrate, self.video_codec_args()[0], s.split_mode, s.first_ep_time, float(s.min_segment_sec),
+                           s.scene_preset, float(s.scene_window or 0), s.single_pass, s.copy_mode], ensure_ascii=False)
+
+    def plan_cuts(self, ffmpeg, file_path, dur):
+        """返回 (切点, 每段是否关键帧对齐, 是否可直接复制音频)"""
+        s = self.settings; min_sec = float(s.min_segment_sec)
+        cuts = [0.0]
+        window = float(s.scene_window or 0)
+        if s.split_mode == "fixed" and window > 0:
+            cuts = self.plan_cuts_windowed(ffmpeg, file_path, dur, parse_time_to_sec(s.first_ep_time), min_sec, window)
+        elif s.split_mode == "fixed":
+            cuts = plan_fixed_cuts(self.find_scenes(ffmpeg, file_path), dur, parse_time_to_sec(s.first_ep_time), min_sec)
+        if cuts[-1] < dur: cuts.append(dur)
+
+        # 复制模式: 源已是目标编码且码率达标时, 切点吸附到关键帧后直接 -c copy;
+        # 吸附不到关键帧的分段仍走正常压制
+        copy_info = self.stream_copy_info(ffmpeg, file_path) if s.copy_mode else None
+        aligned = [False] * (len(cuts) - 1)
+        if copy_info: cuts, aligned = snap_to_keyframes(cuts, copy_info["keyframes"])
+        return cuts, aligned, bool(copy_info) and copy_info["audio_codec"] == "aac"
+
+    @staticmethod
+    def task_key(job):
+        return f"{job['title']}_all" if job["kind"] == "single_pass" else f"{job['title']}_{job['ep']}"
+
+    def run_job(self, job, cpus=None):
+        # 先写 .part, 成功后再原子改名并记入日志
+        src = job["file"]
+        outs = job.get("outs", [job.get("out")])
+        for o in outs: self.journal.mark_pending(o, src)
+
+        # 失败只影响本分段: 退避重试, 硬件编码器 / 直接复制逐级回退, 最终隔离
+        kind, v_codec = job["kind"], self.video_codec_args()[0]
+        ok, details = False, ""; t0 = time.perf_counter(); attempt = 0
+        for attempt in range(RETRY_LIMIT + 1):
+            if attempt:
+                if attempt >= 2 and kind == "copy": kind = "segment"
+                elif attempt >= 2 and any(t in v_codec for t in HW_ENCODER_TAGS): v_codec = software_fallback(v_codec)
+                if attempt >= 2 and job.get("audio"): job = dict(job, audio=None)  # 中间文件可能损坏, 改回逐段编码音频
+                if not self.sleep(RETRY_BACKOFF * 2 ** (attempt - 1)): break
+            if self.error_occurred: break
+            try:
+                ok, details = self.encode_attempt(job, kind, v_codec, cpus)
+                if ok:
+                    for o in outs: self.journal.commit(part_path(o), o, src, job["signature"])
+                    break
+            except OSError as e:
+                ok, details = False, str(e)
+        self.settle_job(job, ok, details, kind, v_codec, time.perf_counter() - t0, attempt + 1, self.proc_stats.pop(self.task_key(job), {}))
+
+    def settle_job(self, job, ok, details, kind, v_codec, wall, attempts, stats, suffix=PART_SUFFIX):
+        """分段结束 (成功且已提交, 或最终失败) 后的收尾: 隔离失败分段、记指标、推进度、判断整个文件是否完成"""
+        src = job["file"]
+        outs = job.get("outs", [job.get("out")])
+        if not ok:
+            for o in outs:
+                self.journal.discard(o + suffix)
+                if not self.error_occurred: self.journal.mark_failed(o, src, details)
+            if not self.error_occurred:
+                entry = {"file": src, "episodes": [job["ep"]] if len(outs) == 1 else list(range(job["ep"], job["ep"] + len(outs))),
+                         "encoder": v_codec, "error": details}
+                with self.task_lock: self.quarantine.append(entry)
+                self.on_failed(entry)
+        if ok: self.eta.observe_encode(v_codec, job["dur"], wall)
+        if not self.error_occurred:
+            self.metrics.record("encode", wall, file=src, episodes=[job["ep"] + i for i in range(len(outs))], kind=kind,
+                                encoder="copy" if kind == "copy" else v_codec, status="done" if ok else "failed", attempts=attempts,
+                                content_sec=round(job["dur"], 3), speed=stats.get("speed"), fps=stats.get("fps"),
+                                bytes=sum(os.path.getsize(o) for o in outs if os.path.exists(o)) if ok else 0)
+        self.bus.finish(self.task_key(job), job["dur"])
+
+        state = job["state"]
+        with self.task_lock:
+            state["remaining"] -= 1; finished = state["remaining"] == 0
+        if finished: self.file_finished(state)
+
+    def encode_attempt(self, job, kind, v_codec, cpus=None, suffix=PART_SUFFIX):
+        """压制一次, 输出写到 成品路径 + suffix 的临时文件; 返回 (是否成功, 错误输出末尾)"""
+        title, ffmpeg, src = job["title"], job["ffmpeg"], job["file"]
+        if kind == "single_pass":
+            return self.convert_single_pass(ffmpeg, src, job["save_path"], title, job["ep"], job["cuts"], suffix, v_codec, cpus)
+        if kind == "copy":
+            return self.convert_copy(ffmpeg, src, job["out"] + suffix, job["start"], job["dur"], title, job["ep"], job["copy_audio"], job.get("audio"))
+        return self.convert_realtime(ffmpeg, src, job["out"] + suffix, job["start"], job["dur"], title, job["ep"], v_codec, cpus, job.get("audio"))
+
+    def sleep(self, sec):
+        """可被终止打断的等待; 返回 False 表示已手动终止"""
+        end = time.time() + sec
+        while time.time() < end:
+            if self.error_occurred: return False
+            time.sleep(0.2)
+        return not self.error_occurred
+
+    def file_finished(self, state):
+        parent_task = state["parent"]; file_path = state["path"]
+        if state.get("release"): state["release"]()  # 监视模式: 腾出一个在途名额
+        if state.get("audio") and not self.error_occurred: remove_audio(state["audio"])  # 终止时保留, 续跑直接复用
+        with self.task_lock:
+            if self.error_occurred: return
+            finished = parent_task.setdefault("finished", set())   # 按路径计数, 重新入队的文件只算一次
+            finished.add(file_path); parent_task["done"] = len(finished)
+        shown = parent_task["files"][0] if len(parent_task["files"]) == 1 else os.path.dirname(file_path)
+        self.on_item_done(parent_task["id"], shown, parent_task["done"], parent_task["total"])
+
+    # --- 压制 ---
+
+    def video_codec_args(self, v_codec=None, cpus=None):
+        """返回 (编码器名, 视频参数); 给出 cpus 时按核心份额限制 CPU 编码器的线程数"""
+        s = self.settings
+        v_codec = v_codec or ENCODER_MAP.get(s.encoder, s.encoder if s.encoder not in ("", None) else "libx264")
+        gpu_id = str(s.gpu_index).strip() or "0"
+        args = ["-c:v", v_codec]
+        if "nvenc" in v_codec: args += ["-gpu", gpu_id]
+        elif "qsv" in v_codec: args += ["-qsv_device", gpu_id]
+        if cpus: args += thread_args(v_codec, len(cpus))
+        return v_codec, args + ["-b:v", s.bitrate]
+
+    def convert_realtime(self, ffmpeg, in_p, out_p, start, dur, title, ep, v_codec=None, cpus=None, audio=None):
+        if self.error_occurred: return False, ""
+        v_codec, v_args = self.video_codec_args(v_codec, cpus)
+        cpus = cpus if v_codec in CPU_ENCODERS else None  # 硬件编码器几乎不占 CPU, 不绑核
+        cmd = [ffmpeg, "-y", "-nostats"] + (["-threads", str(len(cpus))] if cpus else [])
+        cmd += ["-ss", str(round(start, 3)), "-t", str(round(dur, 3)), "-i", in_p]
+        cmd += (audio_input_args(audio, start, dur) + v_args + SEGMENT_AUDIO_MAP) if audio else (v_args + AUDIO_ARGS)
+        cmd += ["-avoid_negative_ts", "make_zero", "-movflags", "+faststart", "-f", "mp4", "-progress", "pipe:1", out_p]
+        return self.run_ffmpeg(cmd, f"{title}_{ep}", title, lambda t: ep, cpus)
+
+    def stream_copy_info(self, ffmpeg, path):
+        """源满足直接复制条件时返回带关键帧索引的探测信息, 否则返回 None"""
+        v_codec, _ = self.video_codec_args()
+        info = self.probe_cache.get(ffmpeg, path)
+        if not can_stream_copy(info, v_codec, parse_bitrate(self.settings.bitrate)): return None
+        return self.probe_cache.get(ffmpeg, path, keyframes=True)
+
+    def convert_copy(self, ffmpeg, in_p, out_p, start, dur, title, ep, copy_audio, audio=None):
+        if self.error_occurred: return False, ""
+        cmd = build_copy_cmd(ffmpeg, in_p, out_p, start, dur, copy_audio, audio)
+        return self.run_ffmpeg(cmd, f"{title}_{ep}", title, lambda t: ep)
+
+    def convert_single_pass(self, ffmpeg, in_p, save_path, title, first_ep, cuts, suffix="", v_codec=None, cpus=None):
+        """整片只解码一次, 在 cuts 处强制关键帧并用 segment 复用器直接切出各集"""
+        if self.error_occurred: return False, ""
+        v_codec, v_args = self.video_codec_args(v_codec, cpus)
+        cpus = cpus if v_codec in CPU_ENCODERS else None
+        cmd = build_single_pass_cmd(ffmpeg, in_p, save_path, title, first_ep, cuts, v_args, v_codec, suffix=suffix,
+                                    input_args=["-threads", str(len(cpus))] if cpus else None)
+        inner = cuts[1:-1]
+        return self.run_ffmpeg(cmd, f"{title}_all", title, lambda t: first_ep + bisect.bisect_right(inner, t), cpus)
+
+    def run_ffmpeg(self, cmd, task_key, title, ep_at, cpus=None):
+        """交给进程监管器运行并解析 -progress 块; ep_at(已压制秒数) -> 当前集号; 返回 (是否成功, 错误输出末尾)"""
+        if self.error_occurred: return False, ""
+        stats = self.proc_stats.setdefault(task_key, {})
+
+        def on_progress(block):
+            try:
+                cur_sec = int(block["out_time_ms"]) / 1000000
+                self.bus.update(task_key, cur_sec, (title, ep_at(cur_sec)))
+            except (KeyError, ValueError): pass
+            for k in ("speed", "fps"):
+                try: stats[k] = float(block[k].rstrip("x"))
+                except (KeyError, ValueError): pass
+
+        # 编码线程在解析完参数后才创建, 会继承启动时的绑核
+        job = supervisor().submit(cmd, on_progress=on_progress, on_start=(lambda pid: pin_process(pid, cpus)) if cpus else None,
+                                  idle_timeout=ENCODE_STALL_SEC, owner=self)
+        self.current_processes.append(job)
+        if self.error_occurred: job.cancel()  # stop() 可能恰好发生在 submit 与登记之间
+        try:
+            res = job.result()
+        finally:
+            if job in self.current_processes: self.current_processes.remove(job)
+        if res.timed_out: return False, f"ffmpeg 超过 {ENCODE_STALL_SEC:.0f} 秒无输出, 已终止\n{res.error}"
+        return res.ok and not self.error_occurred, res.error
+
+    # --- 分析 ---
+
+    def probe_file(self, ffmpeg, path):
+        t0 = time.perf_counter(); dur = self.get_video_duration(ffmpeg, path)
+        self.metrics.record("probe", time.perf_counter() - t0, file=path, duration=dur)
+        return dur
+
+    def get_video_duration(self, ffmpeg, path):
+        # 走持久化探测缓存: 同一文件 (路径+大小+修改时间) 只启动一次 ffmpeg
+        return self.probe_cache.get_duration(ffmpeg, path)
+
+    def find_scenes(self, ffmpeg, path):
+        # 长片按时间段切块, 多个 ffmpeg 并行检测后在边界处合并
+        s = self.settings; t0 = time.perf_counter()
+        scenes = detect_scenes_parallel(ffmpeg, path, self.get_video_duration(ffmpeg, path), preset=s.scene_preset, hwaccel=s.scene_hwaccel)
+        self.metrics.record("scene", time.perf_counter() - t0, file=path, mode="full", preset=s.scene_preset, scenes=len(scenes))
+        return scenes
+
+    def plan_cuts_windowed(self, ffmpeg, path, dur, target_first, min_sec, window):
+        """固定时长模式的窗口扫描版: 只在每个预定切点 ±window 秒内做场景检测 (输入端快速 seek)"""
+        kw = {"preset": self.settings.scene_preset, "hwaccel": self.settings.scene_hwaccel}
+        cuts = [0.0]; t0 = time.perf_counter()
+        if dur > target_first:
+            valid = detect_scenes_window(ffmpeg, path, target_first, min(target_first + window, dur - min_sec), **kw)
+            cuts.append(valid[0] if valid else target_first)
+        while dur - cuts[-1] >= (min_sec * 1.5):
+            if self.error_occurred: break
+            last_p = cuts[-1]; target_nxt = last_p + 60.0
+            valid_nxt = detect_scenes_window(ffmpeg, path, max(last_p + min_sec, target_nxt - window), min(dur - min_sec, target_nxt + window), **kw)
+            if valid_nxt: cuts.append(nearest(valid_nxt, target_nxt))
+            elif (dur - target_nxt) >= min_sec: cuts.append(target_nxt)
+            else: break
+        self.metrics.record("scene", time.perf_counter() - t0, file=path, mode="windowed", preset=self.settings.scene_preset, window=window)
+        return cuts
+
+
+# --- 命令行入口 ---
+
+def format_eta(rem_time):
+    return f"{int(rem_time//60)}m{int(rem_time%60)}s" if rem_time > 60 else f"{int(rem_time)}s"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="视频工厂 - 命令行批量压制/切分")
+    ap.add_argument("inputs", nargs="+", help="视频文件或目录 (递归查找目录下的媒体文件)")
+    ap.add_argument("-o", "--output", required=True, help="输出目录")
+    ap.add_argument("-m", "--mode", choices=["fixed", "auto"], default="fixed", help="fixed: 固定时长切分, auto: 整段输出")
+    ap.add_argument("-e", "--encoder", default="auto", help="auto (探测后选最快) / CPU / NVIDIA显卡 / Intel显卡 / AMD显卡 / Apple加速 (可加 HEVC 后缀), 或 ffmpeg 编码器名")
+    ap.add_argument("-j", "--concurrency", type=int, default=2, help="并发压制数")
+    ap.add_argument("-b", "--bitrate", default="6000k", help="视频码率")
+    ap.add_argument("--gpu", default="0", help="GPU 编号")
+    ap.add_argument("--first-ep", default="4.30", help="首集时长 (分.秒)")
+    ap.add_argument("--min-segment", type=float, default=60.0, help="最小分段 (秒)")
+    ap.add_argument("--scene-preset", choices=list(SCENE_PRESETS), default="accurate")
+    ap.add_argument("--scene-hwaccel", action="store_true", help="场景检测使用硬件解码")
+    ap.add_argument("--scene-window", type=float, default=0.0, help="只在预定切点 ±N 秒内扫描场景 (0=全片)")
+    ap.add_argument("--single-pass", action="store_true", help="单次解码输出全部分集")
+    ap.add_argument("--copy", action="store_true", help="源已达标时直接复制流")
+    ap.add_argument("--adaptive", action="store_true", help="以 -j 为起点自动调整并发数")
+    ap.add_argument("--max-concurrency", type=int, default=0, help="自适应并发上限 (0=核心数)")
+    ap.add_argument("--watch", action="store_true", help="常驻监视输入目录, 新文件写完后自动压制 (Ctrl+C 退出)")
+    ap.add_argument("--watch-interval", type=float, default=10.0, help="监视模式扫描间隔 (秒)")
+    ap.add_argument("--stable-sec", type=float, default=30.0, help="文件大小/修改时间多少秒不变才视为写完")
+    ap.add_argument("--max-inflight", type=int, default=0, help="监视模式同时在途的文件数上限 (0=并发数x2)")
+    ap.add_argument("--serve", default="", metavar="HOST:PORT", help="作为分布式协调机运行, 分段交给 distributed.py worker 压制")
+    ap.add_argument("--lease-sec", type=float, default=60.0, help="协调机: 工作机多少秒无响应即收回任务")
+    ap.add_argument("--token", default="", help="协调机: 工作机需携带的口令")
+    ap.add_argument("--ext", default=".mp4 .mkv .mov", help="目录中视为输入的扩展名")
+    ap.add_argument("--exclude", action="append", default=[], help="排除的文件/目录名通配符, 可多次指定")
+    ap.add_argument("--prom-file", default="", help="Prometheus 文本指标文件 (默认在输出目录)")
+    ap.add_argument("--no-metrics", action="store_true", help="不记录各阶段耗时")
+    ap.add_argument("--per-segment-audio", action="store_true", help="每个分段各自编码音频 (不生成整片音频中间文件)")
+    ap.add_argument("--no-pin", action="store_true", help="不切分/绑定 CPU 核心")
+    ap.add_argument("--list-encoders", action="store_true", help="探测并列出可用编码器后退出")
+    ap.add_argument("--ffmpeg", default=None, help="ffmpeg 路径")
+    args = ap.parse_args(argv)
+
+    ffmpeg = args.ffmpeg or get_ffmpeg_path()
+    if args.list_encoders or args.encoder == "auto":
+        results = start_encoder_probe(ffmpeg, args.gpu).wait()
+        if args.list_encoders:
+            for label, e in results.items():
+                print(f"{label:<16}{e['codec']:<20}" + (f"{e['fps']:>8.1f} fps" if e["ok"] else "   不可用"))
+            return 0
+        # 默认只在 H.264 中选, 避免自动切到 HEVC 改变输出格式
+        args.encoder = best_encoder(results, "h264") or "CPU"
+        if args.encoder in results: print(f"自动选择编码器: {args.encoder} ({results[args.encoder]['fps']:.0f} fps)", flush=True)
+
+    settings = Settings(output_dir=args.output, bitrate=args.bitrate, concurrency=args.concurrency, split_mode=args.mode,
+                        first_ep_time=args.first_ep, min_segment_sec=args.min_segment, encoder=args.encoder, gpu_index=args.gpu,
+                        scene_preset=args.scene_preset, scene_hwaccel=args.scene_hwaccel, scene_window=args.scene_window,
+                        single_pass=args.single_pass, copy_mode=args.copy, cpu_pinning=not args.no_pin,
+                        adaptive_concurrency=args.adaptive, max_concurrency=args.max_concurrency,
+                        metrics=not args.no_metrics, prom_file=args.prom_file, shared_audio=not args.per_segment_audio, media_exts=args.ext, exclude=",".join(args.exclude))
+    engine = BatchEngine(settings, ffmpeg)
+    last_version = [-1]
+
+    def print_progress():
+        _, _, latest, version = engine.bus.snapshot()
+        if latest is None or version == last_version[0]: return
+        last_version[0] = version
+        prog_p, rate, rem = engine.progress()
+        speed = f" | 速度: {rate:.1f}x | 剩: {format_eta(rem)}" if rate is not None else ""
+        print(f"[{min(prog_p, 0.999):6.1%}] 压制中: {latest[0]} - 第{latest[1]}集{speed}", flush=True)
+
+    engine.on_item_done = lambda item_id, path, done, total: print(f"已完成 ({done}/{total}): {path}", flush=True)
+    engine.on_log = lambda msg: print(f"[调度] {msg}", file=sys.stderr, flush=True)
+    engine.on_failed = lambda e: print(f"{os.path.basename(e['file'])} 第 {e['episodes'][0]} 集转换失败, 已隔离 ({e['encoder']})\n{e['error']}", file=sys.stderr, flush=True)
+
+    # 引擎在后台线程运行, 主线程留给 Ctrl+C
+    outcome = {}; items = [(i, os.path.normpath(p)) for i, p in enumerate(args.inputs)]
+    if args.watch:
+        engine.on_item_done = lambda item_id, path, done, total: print(f"已完成: {path}", flush=True)
+        target = lambda: outcome.update(result=engine.watch(items, args.watch_interval, args.stable_sec, args.max_inflight))
+        print(f"监视中: {', '.join(args.inputs)} (Ctrl+C 退出)", flush=True)
+    elif args.serve:
+        from distributed import Coordinator
+        host, _, port = args.serve.rpartition(":")
+        coordinator = Coordinator(engine, host or "0.0.0.0", int(port), args.lease_sec, args.token)
+        target = lambda: outcome.update(result=coordinator.serve(items))
+    else:
+        target = lambda: outcome.update(result=engine.run(items))
+    # join() 被 Ctrl+C 打断后可能不再等待线程结束, 用事件确认引擎已终止进程并落盘
+    finished = threading.Event()
+    def run_engine():
+        try: target()
+        finally: finished.set()
+    runner = threading.Thread(target=run_engine, daemon=True)
+    runner.start()
+    try:
+        while not finished.wait(1.0): print_progress()
+    except KeyboardInterrupt:
+        engine.stop(); finished.wait()
+        if args.watch: print("已退出监视模式", file=sys.stderr); return 0
+        print("任务已手动终止", file=sys.stderr); return 130
+    result = outcome.get("result", "error")
+    if result == "empty":
+        print("未找到有效视频", file=sys.stderr); return 1
+    if result == "error": return 1
+    elapsed = time.time() - engine.start_time
+    print(f"已完成，耗时：{int(elapsed // 60)}分{int(elapsed % 60)}秒")
+    if engine.quarantine:
+        print(f"{len(engine.quarantine)} 个分段失败已隔离:", file=sys.stderr)
+        for e in engine.quarantine: print(f"  {e['file']} 第{'、'.join(map(str, e['episodes']))}集", file=sys.stderr)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import time, threading
+from collections import deque
+
+# --- 剩余时间估算 ---
+# 以"内容秒 / 墙钟秒"为速度单位, 与分段数、每集时长无关:
+#   压制: 进度总线已完成秒数在最近 window 秒内的增量 -> 当前总速度;
+#         刚开始或窗口内没有数据时, 用各编码器已完成任务的平滑速度 x 并发数兜底。
+#   场景检测: 规划线程逐个文件检测, 按单文件平滑速度 x 规划并发估算排队中的检测耗时。
+
+class EtaEstimator:
+    def __init__(self, window=30.0, alpha=0.3, min_span=5.0):
+        self.window = window
+        self.alpha = alpha
+        self.min_span = min_span
+        self.lock = threading.Lock()
+        self.samples = deque()    # (墙钟时间, 已完成内容秒)
+        self.encoder_rate = {}    # 编码器 -> 单任务速度 (平滑)
+        self.scene_rate = None    # 单文件场景检测速度 (平滑)
+
+    def _ema(self, old, new):
+        return new if old is None else old + self.alpha * (new - old)
+
+    def observe_progress(self, done, now=None):
+        now = now or time.time()
+        with self.lock:
+            if self.samples and done < self.samples[-1][1]: self.samples.clear()  # 进度回退 (如重试), 重新取样
+            self.samples.append((now, done))
+            while len(self.samples) > 2 and now - self.samples[1][0] >= self.window: self.samples.popleft()
+
+    def observe_encode(self, encoder, content_sec, wall):
+        if content_sec > 0 and wall > 0:
+            with self.lock: self.encoder_rate[encoder] = self._ema(self.encoder_rate.get(encoder), content_sec / wall)
+
+    def observe_scene(self, content_sec, wall):
+        if content_sec > 0 and wall > 0:
+            with self.lock: self.scene_rate = self._ema(self.scene_rate, content_sec / wall)
+
+    def encode_rate(self, workers=1, encoder=None):
+        """当前总压制速度 (内容秒/墙钟秒); 没有可信数据时返回 None"""
+        with self.lock:
+            if len(self.samples) >= 2:
+                (t0, d0), (t1, d1) = self.samples[0], self.samples[-1]
+                if t1 - t0 >= self.min_span and d1 > d0: return (d1 - d0) / (t1 - t0)
+            prior = self.encoder_rate.get(encoder) or (max(self.encoder_rate.values()) if self.encoder_rate else None)
+        return prior * workers if prior else None
+
+    def estimate(self, done, total, workers=1, encoder=None, scene_pending=0.0, scene_files=0, planners=1):
+        """返回 (总速度, 剩余秒数); 数据不足时为 None
+
+        scene_pending: 已探测、尚未完成场景检测的内容秒数。压制不可能早于最后一个文件
+        检测完成再压完它, 所以剩余时间取 "压完已知内容" 与 "检测完 + 压完最后一个文件" 的较大者。
+        """
+        rate = self.encode_rate(workers, encoder)
+        if not rate: return None, None
+        encode_left = max(0.0, total - done) / rate
+        if scene_files <= 0 or scene_pending <= 0: return rate, encode_left
+        with self.lock: scene_rate = self.scene_rate
+        if not scene_rate: return rate, encode_left
+        scene_left = scene_pending / (scene_rate * max(1, min(planners, scene_files)))
+        last_file = scene_pending / scene_files / rate
+        return rate, max(encode_left, scene_left + last_file)
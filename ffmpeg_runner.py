@@ -0,0 +1,182 @@
+import os, time, asyncio, threading, subprocess, contextlib
+from collections import deque
+from concurrent.futures import Future
+
+# --- ffmpeg 进程监管 ---
+# 所有 ffmpeg 子进程 (探测、场景检测、压制) 都由一个后台线程中的 asyncio 事件循环启动和读取,
+# 不再每个进程占一个阻塞在 stdout 上的线程:
+#   stdout 只接 -progress pipe:1 的 key=value 块 (命令里配合 -nostats), 每收到一个 progress=... 回调一次;
+#   stderr 单独读, 末尾若干行留在有界环形缓冲里做错误信息, 调用方需要的行 (如 showinfo) 用 keep 过滤保留;
+#   超时 (总时长 / 无输出时长) 与取消: 先 terminate, 宽限期后 kill。
+# 调用方可以阻塞等待 run(), 也可以 submit() 拿到句柄并发等待多个进程。
+# 监管器全进程共用, 每个进程记在提交方 (owner, 如某个 BatchEngine) 名下, 终止时只取消自己的。
+
+STDERR_TAIL = 15      # 错误信息保留的 stderr 行数
+KILL_GRACE = 5.0      # terminate 后等待退出的秒数, 超过则 kill
+STREAM_LIMIT = 1 << 20
+
+def startupinfo():
+    si = subprocess.STARTUPINFO() if os.name == 'nt' else None
+    if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return si
+
+
+class FFmpegResult:
+    def __init__(self, returncode, stderr, kept, progress, timed_out=False, cancelled=False):
+        self.returncode = returncode
+        self.stderr = stderr          # stderr 末尾若干行
+        self.kept = kept              # 满足 keep 的全部 stderr 行
+        self.progress = progress      # 最后一个 -progress 块
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    @property
+    def error(self):
+        return "\n".join(self.stderr)
+
+
+class FFmpegJob:
+    """submit() 返回的句柄; cancel() 可在任意线程调用"""
+    def __init__(self, supervisor, cmd, owner=None):
+        self.supervisor = supervisor
+        self.cmd = cmd
+        self.owner = owner
+        self.future = Future()
+        self.pid = None
+        self.cancelled = False
+        self._cancel = None   # 事件循环中的 asyncio.Event
+
+    def cancel(self):
+        self.cancelled = True
+        if self._cancel: self.supervisor.loop.call_soon_threadsafe(self._cancel.set)
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def done(self):
+        return self.future.done()
+
+
+class FFmpegSupervisor:
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+        self.jobs = set()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def owned_by(self, owner):
+        """with 块内本线程 submit 的进程默认记在 owner 名下 (探测、场景检测等工具函数不必逐层传 owner)"""
+        prev = getattr(self.local, "owner", None); self.local.owner = owner
+        try: yield
+        finally: self.local.owner = prev
+
+    def _ensure_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="ffmpeg-supervisor", daemon=True).start()
+            return self.loop
+
+    def submit(self, cmd, on_progress=None, on_start=None, keep=None, timeout=None, idle_timeout=None, tail=STDERR_TAIL, owner=None):
+        """启动 cmd, 立即返回 FFmpegJob
+
+        on_progress(块 dict) 与 on_start(pid) 在监管线程中调用, 应尽快返回;
+        keep(行) 为真的 stderr 行全部保留在结果的 kept 中;
+        timeout 为总时长上限, idle_timeout 为 stdout/stderr 都没有输出的最长时间 (秒);
+        owner 缺省取 owned_by() 设定的本线程 owner。
+        """
+        job = FFmpegJob(self, list(cmd), owner if owner is not None else getattr(self.local, "owner", None))
+        loop = self._ensure_loop()
+        with self.lock: self.jobs.add(job)
+        fut = asyncio.run_coroutine_threadsafe(self._run(job, on_progress, on_start, keep, timeout, idle_timeout, tail), loop)
+        def settle(f):
+            with self.lock: self.jobs.discard(job)
+            if f.exception() is not None: job.future.set_exception(f.exception())
+            else: job.future.set_result(f.result())
+        fut.add_done_callback(settle)
+        return job
+
+    def run(self, cmd, **kw):
+        """阻塞运行, 返回 FFmpegResult; 无法启动 ffmpeg 时抛出 OSError"""
+        return self.submit(cmd, **kw).result()
+
+    def cancel_all(self, owner=None):
+        """取消 owner 名下的全部进程; owner 为 None 时取消所有进程"""
+        with self.lock: jobs = [j for j in self.jobs if owner is None or j.owner is owner]
+        for job in jobs: job.cancel()
+
+    async def _run(self, job, on_progress, on_start, keep, timeout, idle_timeout, tail):
+        job._cancel = asyncio.Event()
+        if job.cancelled: return FFmpegResult(None, [], [], {}, cancelled=True)
+        proc = await asyncio.create_subprocess_exec(*job.cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                    limit=STREAM_LIMIT, startupinfo=startupinfo())
+        job.pid = proc.pid
+        if on_start: on_start(proc.pid)
+        err_tail = deque(maxlen=tail); kept = []; block = {}; last = {}
+        seen = [time.monotonic()]   # 最近一次有输出的时间
+
+        async def read_progress():
+            nonlocal block
+            async for raw in proc.stdout:
+                seen[0] = time.monotonic()
+                k, sep, v = raw.decode("utf-8", "ignore").strip().partition("=")
+                if not sep: continue
+                block[k] = v
+                if k == "progress":   # 一个块以 progress=continue / end 结束
+                    last.clear(); last.update(block); block = {}
+                    if on_progress: on_progress(dict(last))
+
+        async def read_stderr():
+            async for raw in proc.stderr:
+                seen[0] = time.monotonic()
+                line = raw.decode("utf-8", "ignore").rstrip()
+                if keep and keep(line): kept.append(line)
+                if line.strip(): err_tail.append(line.strip())
+
+        io = asyncio.ensure_future(asyncio.gather(read_progress(), read_stderr(), proc.wait()))
+        cancel = asyncio.ensure_future(job._cancel.wait())
+        start = time.monotonic(); timed_out = False
+        try:
+            while not io.done():
+                now = time.monotonic(); wait = 1.0
+                if timeout: wait = min(wait, start + timeout - now)
+                if idle_timeout: wait = min(wait, seen[0] + idle_timeout - now)
+                if wait <= 0:
+                    timed_out = True; break
+                await asyncio.wait({io, cancel}, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if cancel.done(): break
+            if not io.done():
+                await self._stop(proc)
+                await io
+        finally:
+            cancel.cancel()
+            if proc.returncode is None: await self._stop(proc)
+        if io.exception() is not None: raise io.exception()
+        return FFmpegResult(proc.returncode, list(err_tail), kept, last, timed_out, job.cancelled and not timed_out)
+
+    @staticmethod
+    async def _stop(proc):
+        try: proc.terminate()
+        except ProcessLookupError: return
+        try:
+            await asyncio.wait_for(proc.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            try: proc.kill()
+            except ProcessLookupError: pass
+            await proc.wait()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def supervisor():
+    """进程内共用一个监管器 (一个事件循环线程)"""
+    global _shared
+    with _shared_lock:
+        if _shared is None: _shared = FFmpegSupervisor()
+        return _shared
@@ -0,0 +1,118 @@
+import os, json, time, hashlib, threading
+from atomic_file import write_atomic
+
+# --- 任务日志 (断点续跑) ---
+# 每个输出目录一份 .videofactory_journal.json, 记录:
+#   sources:  源文件 (大小+修改时间+参数签名) -> 已规划好的切点, 续跑时不必重新做场景检测
+#   outputs:  分集文件 -> 完成时的大小与抽样校验和 (及源文件的大小+修改时间), 校验一致且源未变才视为已完成
+# 压制先写 *.part, 成功后原子改名, 半截文件永远不会被当成成品。
+
+JOURNAL_NAME = ".videofactory_journal.json"
+JOURNAL_VERSION = 1
+PART_SUFFIX = ".part"
+
+def part_path(out_p):
+    return out_p + PART_SUFFIX
+
+def quick_checksum(path, block=1 << 20):
+    """抽样校验: 文件大小 + 头/中/尾各 1MB 的 sha1, 避免每次续跑都全量读取几百 MB 的成品"""
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as fp:
+        for off in sorted({0, max(0, size // 2 - block // 2), max(0, size - block)}):
+            fp.seek(off); h.update(fp.read(block))
+    return h.hexdigest()
+
+
+class JobJournal:
+    def __init__(self, out_root, flush_interval=2.0):
+        self.path = os.path.join(out_root, JOURNAL_NAME)
+        self.root = os.path.abspath(out_root)
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.dirty = False; self.last_save = 0
+        self.data = {"version": JOURNAL_VERSION, "sources": {}, "outputs": {}}
+        try:
+            with open(self.path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == JOURNAL_VERSION: self.data = data
+        except (OSError, ValueError):
+            pass
+
+    def _rel(self, out_p):
+        return os.path.relpath(os.path.abspath(out_p), self.root)
+
+    @staticmethod
+    def _src_key(src):
+        return os.path.normcase(os.path.abspath(src))
+
+    # --- 切点 ---
+
+    def lookup_plan(self, src, signature):
+        """源文件未变且参数签名一致时, 返回上次规划的 (切点, 是否关键帧对齐)"""
+        try: st = os.stat(src)
+        except OSError: return None
+        with self.lock:
+            e = self.data["sources"].get(self._src_key(src))
+        if e and e["size"] == st.st_size and e["mtime"] == st.st_mtime_ns and e["signature"] == signature:
+            return e["cuts"], e["aligned"]
+        return None
+
+    def record_plan(self, src, signature, cuts, aligned):
+        st = os.stat(src)
+        with self.lock:
+            self.data["sources"][self._src_key(src)] = {"size": st.st_size, "mtime": st.st_mtime_ns, "signature": signature,
+                                                        "cuts": list(cuts), "aligned": list(aligned), "planned_at": time.time()}
+            self.dirty = True
+        self.flush(force=False)
+
+    # --- 分集 ---
+
+    def is_done(self, out_p, source, signature):
+        with self.lock:
+            e = self.data["outputs"].get(self._rel(out_p))
+        if not e or e.get("status") != "done": return False
+        if e.get("source") != self._src_key(source) or e.get("signature") != signature: return False
+        try:
+            st = os.stat(source)
+            if "src_mtime" in e and (e["src_size"], e["src_mtime"]) != (st.st_size, st.st_mtime_ns): return False  # 源文件被原地改写
+            return os.path.getsize(out_p) == e["size"] and quick_checksum(out_p) == e["checksum"]
+        except OSError:
+            return False
+
+    def mark_pending(self, out_p, source):
+        with self.lock:
+            self.data["outputs"][self._rel(out_p)] = {"status": "pending", "source": self._src_key(source), "started_at": time.time()}
+            self.dirty = True
+        self.flush(force=False)
+
+    def mark_failed(self, out_p, source, error):
+        with self.lock:
+            self.data["outputs"][self._rel(out_p)] = {"status": "failed", "source": self._src_key(source), "error": error[-2000:], "failed_at": time.time()}
+            self.dirty = True
+        self.flush(force=False)
+
+    def commit(self, tmp_p, out_p, source, signature):
+        """把 .part 原子改名为成品并记为完成"""
+        os.replace(tmp_p, out_p)
+        st = os.stat(source)
+        entry = {"status": "done", "source": self._src_key(source), "signature": signature, "size": os.path.getsize(out_p),
+                 "checksum": quick_checksum(out_p), "src_size": st.st_size, "src_mtime": st.st_mtime_ns, "finished_at": time.time()}
+        with self.lock:
+            self.data["outputs"][self._rel(out_p)] = entry
+            self.dirty = True
+        self.flush(force=False)
+
+    def discard(self, tmp_p):
+        try: os.remove(tmp_p)
+        except OSError: pass
+
+    def flush(self, force=True):
+        with self.lock:
+            if not self.dirty or (not force and time.time() - self.last_save < self.flush_interval): return
+            text = json.dumps(self.data, ensure_ascii=False)
+            self.dirty = False; self.last_save = time.time()
+        try:
+            write_atomic(self.path, text)
+        except OSError:
+            with self.lock: self.dirty = True
@@ -0,0 +1,78 @@
+import os, fnmatch, threading
+
+# --- 媒体文件索引 ---
+# 一次递归 os.scandir 遍历整棵目录树 (Windows 上 scandir 的条目自带 stat, 网络盘也只需一次往返),
+# 按目录缓存结果: 目录自身的修改时间没变, 说明其中没有增删改名, 再次扫描时直接复用,
+# 只有变化过的目录才重新列举。
+
+MEDIA_EXTS = (".mp4", ".mkv", ".mov")
+DEFAULT_EXCLUDES = (".*", "*.part", "$RECYCLE.BIN", "System Volume Information")
+
+def parse_exts(text):
+    """".mp4,mkv .mov" -> (".mp4", ".mkv", ".mov")"""
+    parts = [p.strip().lower() for p in str(text).replace(",", " ").split() if p.strip()]
+    return tuple(p if p.startswith(".") else "." + p for p in parts) or MEDIA_EXTS
+
+
+class MediaIndex:
+    def __init__(self, exts=MEDIA_EXTS, excludes=DEFAULT_EXCLUDES):
+        self.exts = tuple(e.lower() for e in exts)
+        self.excludes = tuple(p.lower() for p in excludes)
+        self.lock = threading.Lock()
+        self.dirs = {}   # 目录 -> {"mtime", "files": {文件名: (size, mtime_ns)}, "subdirs": [子目录名]}
+        self.rescanned = 0   # 实际重新列举的目录数
+
+    def excluded(self, name):
+        n = name.lower()
+        return any(fnmatch.fnmatchcase(n, p) for p in self.excludes)
+
+    def _list_dir(self, path, mtime):
+        files, subdirs = {}, []
+        try:
+            with os.scandir(path) as it:
+                for e in it:
+                    if self.excluded(e.name): continue
+                    try:
+                        if e.is_dir(follow_symlinks=False): subdirs.append(e.name)
+                        elif e.name.lower().endswith(self.exts):
+                            st = e.stat(); files[e.name] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return {"mtime": mtime, "files": files, "subdirs": sorted(subdirs)}
+
+    def scan(self, root, recursive=True, skip=()):
+        """返回 root 下所有媒体文件的完整路径 (已排序); skip 中的目录 (如输出目录) 整棵跳过"""
+        skip = {os.path.normcase(os.path.abspath(p)) for p in skip}
+        out = []; stack = [os.path.abspath(root)]
+        while stack:
+            d = stack.pop()
+            if os.path.normcase(d) in skip: continue
+            try: mtime = os.stat(d).st_mtime_ns
+            except OSError: continue
+            with self.lock: entry = self.dirs.get(d)
+            if not entry or entry["mtime"] != mtime:
+                entry = self._list_dir(d, mtime)
+                if entry is None: continue
+                with self.lock: self.dirs[d] = entry; self.rescanned += 1
+            out += [os.path.join(d, f) for f in entry["files"]]
+            if recursive: stack += [os.path.join(d, s) for s in reversed(entry["subdirs"])]
+        return sorted(out)
+
+    def stat(self, path):
+        """最近一次扫描时记录的 (size, mtime_ns); 未索引时返回 None"""
+        d, name = os.path.split(os.path.abspath(path))
+        with self.lock: entry = self.dirs.get(d)
+        return entry["files"].get(name) if entry else None
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared_index(exts=MEDIA_EXTS, excludes=DEFAULT_EXCLUDES):
+    """同一组过滤条件共用一个索引, 界面添加目录与开始压制之间不重复扫描"""
+    key = (tuple(exts), tuple(excludes))
+    with _shared_lock:
+        if key not in _shared: _shared[key] = MediaIndex(exts, excludes)
+        return _shared[key]
@@ -0,0 +1,171 @@
+import os, re, sys, json, time, threading
+from atomic_file import write_atomic
+from ffmpeg_runner import supervisor
+
+# --- 媒体探测 + 持久化缓存 ---
+# 缓存键: 规范化绝对路径; 有效性: (size, mtime_ns) 完全一致, 否则重新探测。
+
+CACHE_VERSION = 1
+PROBE_TIMEOUT = 120.0
+
+def default_cache_dir():
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "VideoFactory")
+
+def _to_sec(h, m, s):
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+def parse_ffmpeg_info(text):
+    """解析 `ffmpeg -i` 的 stderr, 返回时长/码率/流信息"""
+    info = {"duration": 0, "bitrate": 0, "streams": [], "video_codec": "", "audio_codec": "",
+            "width": 0, "height": 0, "fps": 0.0, "video_bitrate": 0}
+    m = re.search(r"Duration:\s(\d+):(\d+):(\d+.\d+)", text)
+    if m: info["duration"] = _to_sec(*m.groups())
+    m = re.search(r"Duration:.*?bitrate:\s*(\d+)\s*kb/s", text)
+    if m: info["bitrate"] = int(m.group(1)) * 1000
+
+    for line in text.splitlines():
+        sm = re.search(r"Stream #\d+:(\d+)[^:]*:\s*(Video|Audio|Subtitle|Data):\s*(\w+)(.*)", line)
+        if not sm: continue
+        idx, kind, codec, rest = int(sm.group(1)), sm.group(2).lower(), sm.group(3), sm.group(4)
+        st = {"index": idx, "type": kind, "codec": codec}
+        bm = re.search(r"(\d+)\s*kb/s", rest)
+        if bm: st["bitrate"] = int(bm.group(1)) * 1000
+        if kind == "video":
+            rm = re.search(r"\b(\d{2,5})x(\d{2,5})\b", rest)
+            if rm: st["width"], st["height"] = int(rm.group(1)), int(rm.group(2))
+            fm = re.search(r"([\d.]+)\s*fps", rest)
+            if fm: st["fps"] = float(fm.group(1))
+            if not info["video_codec"]:
+                info["video_codec"] = codec; info["width"] = st.get("width", 0); info["height"] = st.get("height", 0)
+                info["fps"] = st.get("fps", 0.0); info["video_bitrate"] = st.get("bitrate", 0)
+        elif kind == "audio":
+            am = re.search(r"(\d+)\s*Hz", rest)
+            if am: st["sample_rate"] = int(am.group(1))
+            if not info["audio_codec"]: info["audio_codec"] = codec
+        info["streams"].append(st)
+    return info
+
+def run_probe(ffmpeg, path):
+    res = supervisor().run([ffmpeg, "-hide_banner", "-i", path], keep=lambda l: "Duration:" in l or "Stream #" in l, timeout=PROBE_TIMEOUT)
+    return parse_ffmpeg_info("\n".join(res.kept))
+
+def run_keyframe_probe(ffmpeg, path):
+    """只解码关键帧 (-skip_frame nokey), 返回首个视频流的关键帧时间点"""
+    cmd = [ffmpeg, "-hide_banner", "-nostats", "-skip_frame", "nokey", "-i", path,
+           "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"]
+    res = supervisor().run(cmd, keep=lambda l: "pts_time:" in l)
+    points = [float(x) for x in re.findall(r"pts_time:([0-9.]+)", "\n".join(res.kept))]
+    return sorted(set(points))
+
+
+class ProbeCache:
+    def __init__(self, cache_file=None, max_entries=20000, max_age_days=180):
+        self.cache_file = cache_file or os.path.join(default_cache_dir(), "probe_cache.json")
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.lock = threading.Lock()
+        self.entries = None
+        self.dirty = False
+        self.last_save = 0
+        self.hits = 0; self.misses = 0
+
+    @staticmethod
+    def key_of(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _load(self):
+        if self.entries is not None: return
+        self.entries = {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == CACHE_VERSION:
+                now = time.time()
+                self.entries = {k: v for k, v in data.get("entries", {}).items() if now - v.get("atime", 0) < self.max_age}
+        except (OSError, ValueError):
+            pass
+
+    def _lookup(self, key, st):
+        e = self.entries.get(key)
+        if e and e["size"] == st.st_size and e["mtime"] == st.st_mtime_ns:
+            e["atime"] = time.time(); self.dirty = True
+            return e
+        if e: del self.entries[key]  # 文件已变化, 作废
+        return None
+
+    def get(self, ffmpeg, path, keyframes=False):
+        """返回探测信息 dict (keyframes=True 时附带 "keyframes" 列表); 探测失败返回 None"""
+        try: st = os.stat(path)
+        except OSError: return None
+        key = self.key_of(path)
+        with self.lock:
+            self._load()
+            e = self._lookup(key, st)
+            if e and (not keyframes or "keyframes" in e):
+                self.hits += 1
+                return dict(e["info"], keyframes=e["keyframes"]) if "keyframes" in e else dict(e["info"])
+            self.misses += 1
+
+        info = e["info"] if e else run_probe(ffmpeg, path)
+        if not info or info["duration"] <= 0: return None
+        kfs = run_keyframe_probe(ffmpeg, path) if keyframes else None
+
+        with self.lock:
+            e = self.entries.get(key)
+            if not (e and e["size"] == st.st_size and e["mtime"] == st.st_mtime_ns):
+                e = {"size": st.st_size, "mtime": st.st_mtime_ns, "info": info}
+                self.entries[key] = e
+            e["atime"] = time.time()
+            if kfs is not None: e["keyframes"] = kfs
+            self.dirty = True
+            self._evict()
+            result = dict(e["info"], keyframes=e["keyframes"]) if "keyframes" in e else dict(e["info"])
+        if time.time() - self.last_save > 10: self.flush()
+        return result
+
+    def get_duration(self, ffmpeg, path):
+        info = self.get(ffmpeg, path)
+        return info["duration"] if info else 0
+
+    def invalidate(self, path):
+        with self.lock:
+            self._load()
+            if self.entries.pop(self.key_of(path), None) is not None: self.dirty = True
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}; self.dirty = True
+        self.flush()
+
+    def _evict(self):
+        # 按最近访问时间淘汰 (LRU)
+        overflow = len(self.entries) - self.max_entries
+        if overflow > 0:
+            for k, _ in sorted(self.entries.items(), key=lambda kv: kv[1].get("atime", 0))[:overflow]:
+                del self.entries[k]
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty or self.entries is None: return
+            data = json.dumps({"version": CACHE_VERSION, "entries": self.entries}, ensure_ascii=False)
+            self.dirty = False; self.last_save = time.time()
+        try:
+            write_atomic(self.cache_file, data)
+        except OSError:
+            with self.lock: self.dirty = True
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+def shared_cache():
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None: _shared_cache = ProbeCache()
+        return _shared_cache
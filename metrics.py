@@ -0,0 +1,93 @@
+import os, json, time, threading
+from atomic_file import write_atomic
+
+# --- 阶段耗时指标 ---
+# 每个文件/分段的探测、场景检测、规划、压制各记一行 JSON (.jsonl, 追加写),
+# 同时累计成 Prometheus 文本格式 (可交给 node_exporter 的 textfile collector 采集)。
+
+METRICS_NAME = ".videofactory_metrics.jsonl"
+PROM_NAME = "videofactory.prom"
+
+PROM_METRICS = {
+    "videofactory_stage_seconds_total": ("counter", "各阶段累计耗时 (秒)"),
+    "videofactory_stage_runs_total": ("counter", "各阶段执行次数"),
+    "videofactory_encoded_content_seconds_total": ("counter", "已压制的内容时长 (秒)"),
+    "videofactory_encode_wall_seconds_total": ("counter", "压制占用的墙钟时间 (秒, 含重试)"),
+    "videofactory_bytes_written_total": ("counter", "输出文件字节数"),
+    "videofactory_segments_total": ("counter", "压制任务数 (按结果)"),
+    "videofactory_encode_speed": ("gauge", "最近一次压制的 ffmpeg speed (实时倍率)"),
+    "videofactory_encode_fps": ("gauge", "最近一次压制的 ffmpeg fps"),
+}
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}" if labels else ""
+
+
+class Metrics:
+    """record() 线程安全; jsonl_path / prom_path 为 None 时对应输出关闭"""
+    def __init__(self, jsonl_path=None, prom_path=None, flush_interval=10.0):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.values = {}   # (指标名, ((标签, 值), ...)) -> 数值
+        self.last_prom = 0
+        self.fp = None
+        if jsonl_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+                self.fp = open(jsonl_path, "a", encoding="utf-8")
+            except OSError:
+                self.fp = None
+
+    def add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.values[key] = self.values.get(key, 0.0) + value
+
+    def set(self, name, value, **labels):
+        self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def record(self, stage, seconds=0.0, **fields):
+        rec = dict(ts=round(time.time(), 3), stage=stage, seconds=round(seconds, 4), **fields)
+        with self.lock:
+            if self.fp:
+                try: self.fp.write(json.dumps(rec, ensure_ascii=False) + "\n"); self.fp.flush()
+                except OSError: pass
+            self.add("videofactory_stage_seconds_total", seconds, stage=stage)
+            self.add("videofactory_stage_runs_total", 1, stage=stage)
+            if stage == "encode":
+                enc = fields.get("encoder", "")
+                self.add("videofactory_segments_total", 1, status=fields.get("status", ""))
+                self.add("videofactory_encode_wall_seconds_total", seconds, encoder=enc)
+                if fields.get("status") == "done":
+                    self.add("videofactory_encoded_content_seconds_total", fields.get("content_sec", 0.0), encoder=enc)
+                    self.add("videofactory_bytes_written_total", fields.get("bytes", 0), encoder=enc)
+                if fields.get("speed"): self.set("videofactory_encode_speed", fields["speed"], encoder=enc)
+                if fields.get("fps"): self.set("videofactory_encode_fps", fields["fps"], encoder=enc)
+        self.write_prom(force=False)
+
+    def prom_text(self):
+        with self.lock: items = sorted(self.values.items())
+        lines = []
+        for name, (kind, help_text) in PROM_METRICS.items():
+            rows = [(labels, v) for (n, labels), v in items if n == name]
+            if not rows: continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_labels(labels)} {v:g}" for labels, v in rows]
+        return "\n".join(lines) + "\n"
+
+    def write_prom(self, force=True):
+        if not self.prom_path or (not force and time.time() - self.last_prom < self.flush_interval): return
+        self.last_prom = time.time()
+        try:
+            write_atomic(self.prom_path, self.prom_text())  # 采集端不会读到写了一半的文件
+        except OSError:
+            pass
+
+    def close(self):
+        self.write_prom(force=True)
+        with self.lock:
+            if self.fp: self.fp.close(); self.fp = None
@@ -0,0 +1,41 @@
+import threading
+
+# --- 进度总线 ---
+# 工作线程只更新共享计数 (O(1), 不触碰界面), 界面以固定频率 (如 10Hz) 拉取快照。
+# 已完成/进行中秒数都是增量维护的, 拉取时不需要重新求和。
+
+class ProgressBus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.total = 0.0       # 全部内容时长 (秒)
+            self.completed = 0.0   # 已完成任务的时长
+            self.active = {}       # 进行中任务 -> 已处理秒数
+            self.active_sum = 0.0
+            self.latest = None     # 最近一次上报附带的信息, 供界面显示
+            self.version = 0       # 每次更新 +1, 界面据此判断是否需要重绘
+
+    def add_total(self, sec):
+        with self.lock:
+            self.total += sec; self.version += 1
+
+    def update(self, key, sec, info=None):
+        with self.lock:
+            self.active_sum += sec - self.active.get(key, 0.0)
+            self.active[key] = sec
+            if info is not None: self.latest = info
+            self.version += 1
+
+    def finish(self, key, sec):
+        """任务结束: 从进行中移除, 计入已完成 sec 秒"""
+        with self.lock:
+            self.active_sum -= self.active.pop(key, 0.0)
+            self.completed += sec; self.version += 1
+
+    def snapshot(self):
+        """返回 (已处理秒数, 总秒数, 最近信息, 版本号)"""
+        with self.lock:
+            return self.completed + self.active_sum, self.total, self.latest, self.version
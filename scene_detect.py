@@ -0,0 +1,80 @@
+import os, re
+from ffmpeg_runner import supervisor
+
+# --- 场景检测引擎 ---
+# accurate: 原始全分辨率、全帧解码
+# fast:     跳过环路滤波 + 只解参考帧, 缩到 320 宽再算 scene 分数
+# keyframe: 只解码关键帧 (-skip_frame nokey), 编码器通常会在镜头切换处插关键帧
+SCENE_PRESETS = {
+    "accurate": {"input": [], "filter": ""},
+    "fast": {"input": ["-skip_loop_filter", "all", "-skip_frame", "nonref"], "filter": "scale=320:-2,"},
+    "keyframe": {"input": ["-skip_frame", "nokey"], "filter": "scale=320:-2,"},
+}
+PRESET_LABELS = {"精确": "accurate", "快速": "fast", "仅关键帧": "keyframe"}
+SCENE_STALL_SEC = 300.0   # 连 -progress 心跳都没有的时间超过此值视为卡死
+
+def build_scene_cmd(ffmpeg, path, preset="accurate", threshold=0.3, hwaccel=False, start=None, duration=None, threads=None):
+    p = SCENE_PRESETS.get(preset, SCENE_PRESETS["accurate"])
+    # -progress 只作心跳: 长镜头里 showinfo 可能几分钟都没有输出
+    cmd = [ffmpeg, "-hide_banner", "-nostats", "-progress", "pipe:1"]
+    if hwaccel: cmd += ["-hwaccel", "auto"]
+    if threads: cmd += ["-threads", str(threads)]
+    # 输入端快速 seek: 只解码 [start, start+duration] 这一小段
+    if start is not None: cmd += ["-ss", str(round(start, 3))]
+    if duration is not None: cmd += ["-t", str(round(duration, 3))]
+    cmd += p["input"] + ["-i", path, "-map", "0:v:0",
+                         "-filter:v", f"{p['filter']}select=gt(scene\\,{threshold}),showinfo", "-f", "null", "-"]
+    return cmd
+
+def parse_scene_output(lines, offset=0.0):
+    scenes = []
+    for line in lines:
+        if "pts_time:" in line:
+            m = re.search(r"pts_time:([0-9.]+)", line)
+            if m: scenes.append(round(offset + float(m.group(1)), 6))
+    return sorted(set(scenes))
+
+def submit_scenes(ffmpeg, path, preset="accurate", threshold=0.3, hwaccel=False, start=None, duration=None, threads=None):
+    """启动检测进程, 返回监管器句柄; 用 collect_scenes 取结果"""
+    if start is not None: start = round(start, 3)
+    cmd = build_scene_cmd(ffmpeg, path, preset, threshold, hwaccel, start, duration, threads)
+    return supervisor().submit(cmd, keep=lambda l: "pts_time:" in l, idle_timeout=SCENE_STALL_SEC), start, duration
+
+def collect_scenes(handle):
+    job, start, duration = handle
+    # 输入端 -ss 之后时间戳从 0 开始, 需要加回窗口起点
+    scenes = parse_scene_output(job.result().kept, start or 0.0)
+    if start is not None:
+        end = start + duration if duration is not None else float("inf")
+        scenes = [p for p in scenes if start <= p <= end]
+    return scenes
+
+def detect_scenes(ffmpeg, path, preset="accurate", threshold=0.3, hwaccel=False, start=None, duration=None, threads=None):
+    """返回场景切换时间点 (秒, 相对整片); 指定 start/duration 时只分析该时间段"""
+    return collect_scenes(submit_scenes(ffmpeg, path, preset, threshold, hwaccel, start, duration, threads))
+
+def detect_scenes_window(ffmpeg, path, lo, hi, **kw):
+    """只在 [lo, hi] 窗口内做场景检测"""
+    if hi <= lo: return []
+    return detect_scenes(ffmpeg, path, start=max(0.0, lo), duration=hi - max(0.0, lo), **kw)
+
+def detect_scenes_parallel(ffmpeg, path, duration, workers=None, min_chunk=120.0, overlap=2.0, **kw):
+    """按时间段切块并行检测, 结果与串行一致
+
+    每块向前多解码 overlap 秒, 让块首帧也有前序帧参与 scene 打分;
+    每块只保留落在 [lo, hi) 内的点, 拼接后即为整片结果。
+    各块的 ffmpeg 同时交给监管器运行, 这里只等结果, 不另开线程。
+    """
+    workers = workers or os.cpu_count() or 1
+    n = min(workers, int(duration // min_chunk)) if duration else 1
+    if n <= 1: return detect_scenes(ffmpeg, path, **kw)
+    bounds = [round(duration * i / n, 3) for i in range(n)] + [float("inf")]
+    threads = max(1, (os.cpu_count() or 1) // n)
+
+    handles = []
+    for i in range(n):
+        s = max(0.0, bounds[i] - overlap) if i > 0 else None
+        d = bounds[i + 1] - (s or 0.0) if i < n - 1 else None
+        handles.append(submit_scenes(ffmpeg, path, start=s, duration=d, threads=threads, **kw))
+    chunks = [[p for p in collect_scenes(h) if bounds[i] <= p < bounds[i + 1]] for i, h in enumerate(handles)]
+    return sorted(set(p for c in chunks for p in c))
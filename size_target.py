@@ -0,0 +1,63 @@
+import os, json, threading
+from media_probe import default_cache_dir
+from atomic_file import write_atomic
+
+# --- 按体积上限分配码率 ---
+# 旧算法按标称码率估算体积, 实际输出常偏离 ±10%: 偏大要返工, 偏小则多切了一段。
+# 这里反过来: 先按上限算每段可用的码率预算 (不超过用户设定码率), 在允许的最低码率下
+# 仍放不下才增加分段; 压完后用真实体积校准编码器的"实际/标称"比例, 持久化供下次使用。
+
+AUDIO_BPS = 192000
+MUX_OVERHEAD = 0.01       # mp4 封装开销约 1%
+SIZE_SAFETY = 0.97        # 目标体积 = 上限 * 0.97, 给码率波动留余量
+MIN_BITRATE_RATIO = 0.75  # 为少切一段, 码率最多降到设定值的 75%
+MODEL_FILE = "size_model.json"
+
+def predict_bytes(dur, video_bps, ratio=1.0):
+    return (ratio * video_bps + AUDIO_BPS) * dur / 8 * (1 + MUX_OVERHEAD)
+
+def plan_splits(dur, max_bytes, bitrate_bps, ratio=1.0):
+    """在码率不低于 MIN_BITRATE_RATIO * 设定值的前提下, 每段都不超过上限所需的最少段数"""
+    floor = predict_bytes(dur, bitrate_bps * MIN_BITRATE_RATIO, ratio)
+    return max(1, -int(-floor // (max_bytes * SIZE_SAFETY)))
+
+def segment_bitrate(seg_dur, max_bytes, bitrate_bps, ratio=1.0):
+    """时长 seg_dur 的分段在上限内可用的视频码率 (bps), 不超过设定码率"""
+    budget = (max_bytes * SIZE_SAFETY / (1 + MUX_OVERHEAD) * 8 / max(seg_dur, 0.001) - AUDIO_BPS) / max(ratio, 0.1)
+    return int(max(100000, min(bitrate_bps, budget)))
+
+def rate_args(video_bps):
+    """ABR + VBV 限制峰值, 避免单段体积冲过预算"""
+    k = video_bps // 1000
+    return ["-b:v", f"{k}k", "-maxrate", f"{int(k * 1.5)}k", "-bufsize", f"{k * 2}k"]
+
+
+class SizeModel:
+    """各编码器的实际/标称视频码率比例, 指数平滑后持久化"""
+    def __init__(self, cache_file=None, alpha=0.3):
+        self.cache_file = cache_file or os.path.join(default_cache_dir(), MODEL_FILE)
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as fp: self.ratios = json.load(fp)
+        except (OSError, ValueError):
+            self.ratios = {}
+
+    def ratio(self, v_codec):
+        return self.ratios.get(v_codec, 1.0)
+
+    def observe(self, v_codec, dur, video_bps, actual_bytes):
+        """用一个成品的真实体积校准比例; 返回本次观测到的比例"""
+        audio_bytes = AUDIO_BPS * dur / 8
+        video_bytes = actual_bytes / (1 + MUX_OVERHEAD) - audio_bytes
+        if dur <= 0 or video_bps <= 0 or video_bytes <= 0: return None
+        r = min(2.0, max(0.3, video_bytes * 8 / (video_bps * dur)))
+        with self.lock:
+            old = self.ratios.get(v_codec)
+            self.ratios[v_codec] = r if old is None else old + self.alpha * (r - old)
+            text = json.dumps(self.ratios)
+        try:
+            write_atomic(self.cache_file, text)
+        except OSError:
+            pass
+        return r
@@ -1,9 +1,12 @@
 import customtkinter as ct
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import os, re, subprocess, threading, sys, time
+import os, re, threading, sys, time
 import ctypes
-from concurrent.futures import ThreadPoolExecutor
+from engine import BatchEngine, Settings, get_ffmpeg_path, get_platform_encoders, start_encoder_probe, format_eta, list_media
+from media_index import MEDIA_EXTS
+from encoder_probe import rank_encoders, best_encoder
+from scene_detect import PRESET_LABELS
 
 # --- 1. Windows 任务栏图标修复 (必须在窗口创建前) ---
 try:
@@ -47,21 +50,6 @@ except ImportError:
 ct.set_appearance_mode("dark")
 ct.set_default_color_theme("blue")
 
-def get_ffmpeg_path():
-    if getattr(sys, 'frozen', False):
-        base_path = sys._MEIPASS
-    else:
-        base_path = os.path.dirname(os.path.abspath(__file__))
-    ffmpeg_bin = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
-    local_ffmpeg = os.path.join(base_path, ffmpeg_bin)
-    return local_ffmpeg if os.path.exists(local_ffmpeg) else "ffmpeg"
-
-def get_platform_encoders():
-    if sys.platform == "darwin":
-        return ["CPU", "Apple加速"]
-    else:
-        return ["CPU", "NVIDIA显卡", "Intel显卡", "AMD显卡"]
-
 class VideoConverterApp:
     def __init__(self, root):
         self.root = root
@@ -87,19 +75,37 @@ class VideoConverterApp:
         self.encoder_options = get_platform_encoders()
         self.encoder_var = tk.StringVar(value=self.encoder_options[0])
         self.gpu_index = tk.StringVar(value="0") 
+        self.scene_preset = tk.StringVar(value="精确")
+        self.scene_hwaccel = tk.BooleanVar(value=False)
+        self.scene_window = tk.StringVar(value="0")
+        self.single_pass = tk.BooleanVar(value=False)
+        self.copy_mode = tk.BooleanVar(value=False)
+        self.adaptive = tk.BooleanVar(value=False)
+        self.watch_mode = tk.BooleanVar(value=False)
         
         self.ffmpeg_path = get_ffmpeg_path()
-        self.total_duration = 0      
-        self.completed_duration = 0  
-        self.active_durations = {}   
-        self.total_segments_est = 0  
-        self.start_time = 0
+        self.engine = None
         self.is_running = False
-        self.error_occurred = False 
-        self.current_processes = []
+        self.shown_version = -1
 
         self._setup_ui()
 
+        # 后台探测编码器, 不阻塞窗口打开; 完成后只保留可用项并默认选最快的
+        self.encoder_touched = False
+        self.encoder_var.trace_add("write", lambda *a: setattr(self, "encoder_touched", True))
+        start_encoder_probe(self.ffmpeg_path, self.gpu_index.get(),
+                            on_done=lambda results: self.root.after(0, lambda: self.apply_encoder_probe(results)))
+
+    def apply_encoder_probe(self, results):
+        ranked = rank_encoders(results)
+        if not ranked: return
+        best = best_encoder(results, "h264") or ranked[0]
+        self.encoder_options = ranked
+        if not self.encoder_touched or self.encoder_var.get() not in ranked:
+            self.encoder_var.set(best); self.encoder_touched = False
+        if not self.is_running:
+            self.status_lbl.configure(text=f"已检测编码器，默认使用最快的：{best} ({results[best]['fps']:.0f} fps)")
+
     def _setup_ui(self):
         # 顶部按钮
         self.top_btn_frame = ct.CTkFrame(self.root, fg_color="#1a1a1a", corner_radius=0)
@@ -166,12 +172,8 @@ class VideoConverterApp:
         if not self.is_running:
             return
         if messagebox.askyesno("确认", "确定要终止当前所有压制任务吗？"):
-            self.error_occurred = True
             self.is_running = False
-            for p in self.current_processes:
-                try: p.terminate()
-                except: pass
-            self.current_processes = []
+            if self.engine: self.engine.stop()
             self.root.after(0, lambda: [
                 self.status_lbl.configure(text="任务已手动终止", text_color="#e67e22"),
                 self.prog.set(0),
@@ -180,7 +182,7 @@ class VideoConverterApp:
             ])
 
     def open_settings(self):
-        win = tk.Toplevel(self.root); win.title("导出设置"); win.geometry("400x460"); win.configure(bg="#1a1a1a")
+        win = tk.Toplevel(self.root); win.title("导出设置"); win.geometry("400x695"); win.configure(bg="#1a1a1a")
         win.resizable(False, False); win.transient(self.root); win.grab_set()
         
         # 这里的 Toplevel 也可以设置图标
@@ -193,6 +195,7 @@ class VideoConverterApp:
         for label, var in [("视频码率:", self.bitrate), ("并发任务:", self.concurrency)]:
             row = ct.CTkFrame(container, fg_color="transparent"); row.pack(fill="x", pady=2)
             ct.CTkLabel(row, text=label).pack(side=tk.LEFT); ct.CTkEntry(row, textvariable=var, width=130, height=28).pack(side=tk.RIGHT)
+        ct.CTkCheckBox(container, text="自适应并发 (以上面的数值为起点)", variable=self.adaptive, font=("微软雅黑", 12)).pack(anchor="w", pady=(4, 2))
 
         ct.CTkLabel(container, text="⚙️ 编码设置", font=("微软雅黑", 14, "bold"), text_color="#e67e22").pack(anchor="w", pady=(10, 5))
         row_e = ct.CTkFrame(container, fg_color="transparent"); row_e.pack(fill="x", pady=2)
@@ -205,132 +208,79 @@ class VideoConverterApp:
         f_mode = ct.CTkFrame(container, fg_color="transparent"); f_mode.pack(fill="x", pady=2)
         ct.CTkRadioButton(f_mode, text="固定时长", variable=self.split_mode, value="fixed", font=("微软雅黑", 12)).pack(side=tk.LEFT)
         ct.CTkRadioButton(f_mode, text="自动平分", variable=self.split_mode, value="auto", font=("微软雅黑", 12)).pack(side=tk.RIGHT)
-        for label, var in [("首集时长:", self.first_ep_time), ("最小分段:", self.min_segment_sec)]:
+        for label, var in [("首集时长:", self.first_ep_time), ("最小分段:", self.min_segment_sec), ("扫描窗口(秒,0=全片):", self.scene_window)]:
             row = ct.CTkFrame(container, fg_color="transparent"); row.pack(fill="x", pady=2)
             ct.CTkLabel(row, text=label).pack(side=tk.LEFT); ct.CTkEntry(row, textvariable=var, width=130, height=28).pack(side=tk.RIGHT)
+        row_s = ct.CTkFrame(container, fg_color="transparent"); row_s.pack(fill="x", pady=2)
+        ct.CTkLabel(row_s, text="场景检测:").pack(side=tk.LEFT)
+        ct.CTkOptionMenu(row_s, values=list(PRESET_LABELS), variable=self.scene_preset, width=130, height=28).pack(side=tk.RIGHT)
+        ct.CTkCheckBox(container, text="场景检测使用硬件解码", variable=self.scene_hwaccel, font=("微软雅黑", 12)).pack(anchor="w", pady=(4, 2))
+        ct.CTkCheckBox(container, text="单次解码输出全部分集", variable=self.single_pass, font=("微软雅黑", 12)).pack(anchor="w", pady=2)
+        ct.CTkCheckBox(container, text="源已达标时直接复制流 (切点对齐关键帧)", variable=self.copy_mode, font=("微软雅黑", 12)).pack(anchor="w", pady=2)
+        ct.CTkCheckBox(container, text="监视模式 (持续压制目录中新写入的文件)", variable=self.watch_mode, font=("微软雅黑", 12)).pack(anchor="w", pady=2)
 
         ct.CTkButton(container, text="确 定", fg_color="#27ae60", height=35, command=win.destroy).pack(side=tk.BOTTOM, pady=(20, 5), fill="x")
 
-    # (中间的业务逻辑处理方法 get_video_duration, orchestrator, process_single_file 等保持不变...)
-    def orchestrator(self):
-        ffmpeg = self.ffmpeg_path; all_tasks = []
-        self.root.after(0, lambda: self.status_lbl.configure(text="正在分析时长...", text_color="#95a5a6"))
-        for item_id in self.tree.get_children():
-            path = self.tree.item(item_id, "values")[0]
-            files = [path] if not os.path.isdir(path) else sorted([os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".mp4")])
-            item_info = {"id": item_id, "files": files, "total": len(files), "done": 0}
-            for f in files:
-                d = self.get_video_duration(ffmpeg, f)
-                if d > 0:
-                    self.total_duration += d; self.total_segments_est += max(1, int(d // 60))
-                    all_tasks.append((f, item_info, ffmpeg))
-
-        if not all_tasks:
-            self.root.after(0, lambda: messagebox.showerror("错误", "未找到有效视频")); self.is_running = False; self.set_ui_state(True); return
-
+    # 业务逻辑都在 engine.BatchEngine 中, 这里只负责把引擎事件转到界面线程
+    def build_settings(self):
+        try: window = float(self.scene_window.get())
+        except ValueError: window = 0
+        return Settings(output_dir=self.output_dir.get(), bitrate=self.bitrate.get(), concurrency=int(self.concurrency.get()),
+                        split_mode=self.split_mode.get(), first_ep_time=self.first_ep_time.get(), min_segment_sec=float(self.min_segment_sec.get()),
+                        encoder=self.encoder_var.get(), gpu_index=self.gpu_index.get(),
+                        scene_preset=PRESET_LABELS.get(self.scene_preset.get(), "accurate"), scene_hwaccel=self.scene_hwaccel.get(),
+                        scene_window=window, single_pass=self.single_pass.get(), copy_mode=self.copy_mode.get(),
+                        adaptive_concurrency=self.adaptive.get())
+
+    def orchestrator(self, engine, items, watch=False):
+        engine.on_item_done = lambda item_id, path, done, total: self.root.after(0, lambda: self.tree.item(item_id, values=(path, f"已完成 ({done}/{total})")))
+        # 单个分段失败只隔离, 不打断整批; 结束后统一汇总
+        # 调度决策同时记入输出目录的指标 jsonl; 打包成无控制台程序时 print 看不到, 这里显示在状态栏
+        engine.on_log = lambda msg: self.root.after(0, lambda: self.status_lbl.configure(text=f"调度: {msg}", text_color="#95a5a6"))
+        engine.on_failed = lambda e: self.root.after(0, lambda: self.status_lbl.configure(
+            text=f"第 {e['episodes'][0]} 集失败已隔离: {os.path.basename(e['file'])}", text_color="#e67e22"))
         try:
-            with ThreadPoolExecutor(max_workers=int(self.concurrency.get())) as executor:
-                list(executor.map(lambda p: self.process_single_file(*p), all_tasks))
-            
-            if not self.error_occurred and self.is_running:
-                total_elapsed = time.time() - self.start_time
+            if watch:
+                # 常驻运行, 只有点"终止进程"才返回
+                self.root.after(0, lambda: self.status_lbl.configure(text="监视中，等待新文件...", text_color="#95a5a6"))
+                engine.watch(items); return
+            result = engine.run(items)
+            if result == "empty":
+                self.root.after(0, lambda: messagebox.showerror("错误", "未找到有效视频"))
+            elif result == "done" and self.is_running:
+                total_elapsed = time.time() - engine.start_time
                 h, m, s = int(total_elapsed // 3600), int((total_elapsed % 3600) // 60), int(total_elapsed % 60)
                 final_time = f"{h}时{m}分{s}秒" if h > 0 else f"{m}分{s}秒"
-                self.root.after(0, lambda: [self.status_lbl.configure(text=f"已完成，耗时：{final_time}", text_color="#27ae60"), self.prog.set(1.0), flash_window(self.root.winfo_id())])
-        except Exception:
-            pass 
+                failed = engine.quarantine
+                if failed:
+                    summary = "\n".join(f"{os.path.basename(e['file'])} 第{'、'.join(map(str, e['episodes']))}集" for e in failed[:20])
+                    self.root.after(0, lambda: [self.status_lbl.configure(text=f"已完成，耗时：{final_time}，{len(failed)} 个分段失败", text_color="#e67e22"),
+                                                self.prog.set(1.0), flash_window(self.root.winfo_id()),
+                                                messagebox.showwarning("部分分段失败", f"以下分段重试后仍失败，已隔离：\n\n{summary}\n\n错误信息：\n{failed[0]['error']}")])
+                else:
+                    self.root.after(0, lambda: [self.status_lbl.configure(text=f"已完成，耗时：{final_time}", text_color="#27ae60"), self.prog.set(1.0), flash_window(self.root.winfo_id())])
         finally:
             self.is_running = False; self.root.after(0, lambda: self.set_ui_state(True))
 
-    def process_single_file(self, file_path, parent_task, ffmpeg):
-        if self.error_occurred: return 
-        out_root = self.output_dir.get(); min_sec = float(self.min_segment_sec.get()); dur = self.get_video_duration(ffmpeg, file_path)
-        fname = os.path.basename(file_path); raw_ep = 1; title = os.path.splitext(fname)[0]
-        
-        ep_match = re.search(r"第(\d+)集", fname)
-        start_num_match = re.match(r"^(\d+)", fname)
-        if ep_match:
-            raw_ep = int(ep_match.group(1)); title = re.sub(r"[-]?第\d+集", "", title).strip()
-        elif start_num_match:
-            raw_ep = int(start_num_match.group(1)); title = re.sub(r"^\d+[- ]*", "", title).strip()
-        
-        save_path = os.path.join(out_root, title); os.makedirs(save_path, exist_ok=True)
-        cuts = [0.0]
-        if self.split_mode.get() == "fixed":
-            scenes = self.find_scenes(ffmpeg, file_path); target_first = self.parse_time_to_sec(self.first_ep_time.get())
-            if dur > target_first:
-                valid = [p for p in scenes if p >= target_first and (dur - p) >= min_sec]
-                cuts.append(min(valid, key=lambda x: x - target_first) if valid else target_first)
-            while dur - cuts[-1] >= (min_sec * 1.5):
-                last_p = cuts[-1]; target_nxt = last_p + 60.0; valid_nxt = [p for p in scenes if (p - last_p) >= min_sec and (dur - p) >= min_sec]
-                if valid_nxt: cuts.append(min(valid_nxt, key=lambda x: abs(x - target_nxt)))
-                elif (dur - (last_p + 60.0)) >= min_sec: cuts.append(last_p + 60.0)
-                else: break
-        if cuts[-1] < dur: cuts.append(dur)
-
-        for i in range(len(cuts)-1):
-            if self.error_occurred: break 
-            curr_ep = raw_ep + i; seg_dur = cuts[i+1] - cuts[i]; out_f = os.path.join(save_path, f"{title}-第{curr_ep}集.mp4")
-            self.convert_realtime(ffmpeg, file_path, out_f, cuts[i], seg_dur, title, curr_ep)
-            self.completed_duration += seg_dur; self.active_durations.pop(f"{title}_{curr_ep}", None)
-        
-        parent_task["done"] += 1
-        self.root.after(0, lambda: self.tree.item(parent_task["id"], values=(parent_task["files"][0] if len(parent_task["files"])==1 else os.path.dirname(file_path), f"已完成 ({parent_task['done']}/{parent_task['total']})")))
-
-    def convert_realtime(self, ffmpeg, in_p, out_p, start, dur, title, ep):
-        if self.error_occurred: return
-        encoder_map = {"CPU": "libx264", "Apple加速": "h264_videotoolbox", "NVIDIA显卡": "h264_nvenc", "Intel显卡": "h264_qsv", "AMD显卡": "h264_amf"}
-        v_codec = encoder_map.get(self.encoder_var.get(), "libx264")
-        gpu_id = self.gpu_index.get().strip() if self.gpu_index.get() else "0"
-        
-        cmd = [ffmpeg, "-y", "-ss", str(round(start, 3)), "-t", str(round(dur, 3)), "-i", in_p, "-c:v", v_codec]
-        if "nvenc" in v_codec: cmd += ["-gpu", gpu_id]
-        elif "qsv" in v_codec: cmd += ["-qsv_device", gpu_id]
-        cmd += ["-b:v", self.bitrate.get(), "-c:a", "aac", "-b:a", "192k", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart", "-progress", "pipe:1", out_p]
-
-        si = subprocess.STARTUPINFO() if os.name == 'nt' else None
-        if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, encoding='utf-8', startupinfo=si)
-        self.current_processes.append(proc)
-        
-        task_key = f"{title}_{ep}"; last_error_log = []
-        for line in proc.stdout:
-            if self.error_occurred:
-                proc.terminate(); break
-            if "out_time_ms=" in line:
-                try:
-                    curr_ms = int(line.split('=')[1]); self.active_durations[task_key] = curr_ms / 1000000
-                    self.root.after(0, lambda t=title, e=ep: self.update_smooth_ui(t, e))
-                except: pass
-            else:
-                if line.strip(): last_error_log.append(line.strip())
-                if len(last_error_log) > 15: last_error_log.pop(0)
-        
-        proc.wait()
-        if proc in self.current_processes: self.current_processes.remove(proc)
-        
-        if proc.returncode != 0 and not self.error_occurred:
-            self.error_occurred = True 
-            err_details = "\n".join(last_error_log)
-            self.root.after(0, lambda: [
-                self.status_lbl.configure(text="任务出错已终止", text_color="#e74c3c"),
-                self.prog.set(0),
-                messagebox.showerror("压制出错", f"第 {ep} 集转换失败！\n\n错误信息：\n{err_details}")
-            ])
-
-    def update_smooth_ui(self, title, ep):
-        if not self.is_running or self.error_occurred: return
-        self.status_lbl.configure(text=f"压制中: {title} - 第{ep}集", text_color="#95a5a6")
-        total_done_sec = self.completed_duration + sum(self.active_durations.values())
-        if self.total_duration > 0:
-            prog_p = total_done_sec / self.total_duration; self.prog.set(min(prog_p, 0.999))
-            elapsed = time.time() - self.start_time
-            if total_done_sec > 2:
-                eq_done_eps = prog_p * self.total_segments_est; avg = elapsed / max(eq_done_eps, 0.001)
-                rem_time = avg * (self.total_segments_est - eq_done_eps)
-                rem_str = f"{int(rem_time//60)}m{int(rem_time%60)}s" if rem_time > 60 else f"{int(rem_time)}s"
-                self.speed_lbl.configure(text=f"速度: {avg:.1f}s/ep | 剩: {rem_str}")
+    def poll_progress(self):
+        """界面线程以 10Hz 拉取进度总线, 工作线程不再向事件队列投递任务"""
+        if not self.is_running: return
+        self.update_smooth_ui()
+        self.root.after(100, self.poll_progress)
+
+    def update_smooth_ui(self):
+        engine = self.engine
+        if not self.is_running or not engine or engine.error_occurred: return
+        _, total, latest, version = engine.bus.snapshot()
+        if latest is None or version == self.shown_version: return
+        self.shown_version = version; title, ep = latest
+        probing = f" (分析 {engine.probe_done}/{engine.probe_total})" if engine.probe_done < engine.probe_total else ""
+        self.status_lbl.configure(text=f"压制中: {title} - 第{ep}集{probing}", text_color="#95a5a6")
+        prog_p, rate, rem_time = engine.progress()
+        if total > 0:
+            self.prog.set(min(prog_p, 0.999))
+            if rate is not None:
+                self.speed_lbl.configure(text=f"速度: {rate:.1f}x | 剩: {format_eta(rem_time)}")
 
     def set_ui_state(self, is_normal):
         state = "normal" if is_normal else "disabled"
@@ -339,29 +289,6 @@ class VideoConverterApp:
         if is_normal: self.start_btn.configure(state="normal", fg_color="#27ae60", text="开始执行任务")
         else: self.start_btn.configure(state="disabled", fg_color="gray", text="正在运行...")
 
-    def get_video_duration(self, ffmpeg, path):
-        si = subprocess.STARTUPINFO() if os.name == 'nt' else None
-        if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        res = subprocess.run([ffmpeg, "-i", path], capture_output=True, text=True, errors='ignore', startupinfo=si)
-        match = re.search(r"Duration:\s(\d+):(\d+):(\d+.\d+)", res.stderr)
-        return int(match.group(1))*3600 + int(match.group(2))*60 + float(match.group(3)) if match else 0
-
-    def find_scenes(self, ffmpeg, path):
-        si = subprocess.STARTUPINFO() if os.name == 'nt' else None
-        if si: si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        cmd = [ffmpeg, "-i", path, "-filter:v", "select=gt(scene\\,0.3),showinfo", "-f", "null", "-"]
-        proc = subprocess.Popen(cmd, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, text=True, errors='ignore', startupinfo=si)
-        scenes = []
-        for line in proc.stdout:
-            if "pts_time:" in line:
-                m = re.search(r"pts_time:([0-9.]+)", line)
-                if m: scenes.append(float(m.group(1)))
-        return sorted(list(set(scenes)))
-
-    def parse_time_to_sec(self, t_str):
-        try: m, s = map(int, t_str.split('.')); return m * 60 + s
-        except: return 270
-
     def add_files(self):
         files = filedialog.askopenfilenames(filetypes=[("视频文件", "*.mp4 *.mkv *.mov"), ("所有文件", "*.*")])
         for f in files: self.add_path_to_tree(os.path.normpath(f))
@@ -371,9 +298,10 @@ class VideoConverterApp:
         if folder: self.add_path_to_tree(os.path.normpath(folder))
 
     def add_path_to_tree(self, p):
+        # 目录递归计数; 与开始压制时共用索引, 不会重复列举没变化的目录
         count = 0
-        if os.path.isdir(p): count = len([f for f in os.listdir(p) if f.lower().endswith(".mp4")])
-        elif p.lower().endswith((".mp4", ".mkv", ".mov")): count = 1
+        if os.path.isdir(p): count = len(list_media(p))
+        elif p.lower().endswith(MEDIA_EXTS): count = 1
         if count > 0: self.tree.insert("", tk.END, values=(p, f"等待中 (0/{count})"))
 
     def delete_all(self):
@@ -394,6 +322,9 @@ class VideoConverterApp:
     def start_task(self):
         if not self.tree.get_children() or not self.output_dir.get():
             messagebox.showwarning("提示", "请检查列表和输出路径"); return
+        try: settings = self.build_settings()
+        except ValueError:
+            messagebox.showwarning("提示", "请检查导出设置中的数值"); return
         
         for item_id in self.tree.get_children():
             current_vals = self.tree.item(item_id, "values")
@@ -406,10 +337,12 @@ class VideoConverterApp:
         self.prog.set(0)
         self.speed_lbl.configure(text="速度: -- | 剩: --")
         
-        self.is_running = True; self.error_occurred = False; self.set_ui_state(False)
-        self.start_time = time.time(); self.completed_duration = 0
-        self.total_duration = 0; self.total_segments_est = 0; self.active_durations = {}; self.current_processes = []
-        threading.Thread(target=self.orchestrator, daemon=True).start()
+        items = [(item_id, self.tree.item(item_id, "values")[0]) for item_id in self.tree.get_children()]
+        self.engine = BatchEngine(settings, self.ffmpeg_path)
+        self.is_running = True; self.shown_version = -1; self.set_ui_state(False)
+        # 界面变量只在界面线程读取, 和 settings 一样在这里取好再交给工作线程
+        threading.Thread(target=self.orchestrator, args=(self.engine, items, self.watch_mode.get()), daemon=True).start()
+        self.poll_progress()
 
 if __name__ == "__main__":
     root = RootWindow()